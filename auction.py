@@ -0,0 +1,214 @@
+from eventsink import NullSink
+from itertools import accumulate
+from orderbook import LIMIT, MARKET, STOP, CANCEL, AMEND, BUY, OrderBook, Order
+import argparse
+import logging
+import random
+import time
+
+
+class CallAuction:
+    def __init__(self, book):
+        """Batch auction for the opening and closing of an OrderBook.
+
+        While the auction is running, order_sorter hands limit and market orders to the auction instead of matching
+        them, and holds stop orders back.  uncross() then fills everything it can at one clearing price.  The start
+        and uncross of the auction are sent to the book's sink, so a persistence.Journal replays them."""
+        self.book = book
+        # Collected limit and market orders by order number, in arrival order
+        self.orders = {}
+        # Stop orders held back until the uncross, by order number
+        self.stops = {}
+
+    def start(self):
+        """Begin collecting orders, pulling the resting limit orders of the book into the auction"""
+        self.book.sink.on_auction(True)
+        # Set first, so sinks can tell the resting orders pulled below from cancels
+        self.book.auction = self
+        for q, side in ((self.book.buy_queue, 'BUY'), (self.book.sell_queue, 'SELL')):
+            for [price, order_id, volume] in sorted(q.entries(), key=lambda entry: entry[1]):
+                self.orders[order_id] = Order(order_id, ['Limit', side, volume, price])
+            q.remove_all()
+        self.orders = dict(sorted(self.orders.items()))
+
+    def collect(self, order_in):
+        """Called by order_sorter for every order arriving during the auction"""
+        type_code = order_in.type_code
+        if type_code == LIMIT or type_code == MARKET:
+            if order_in.side_code is None:
+                raise ValueError('Bad Inputs!')
+            self.orders[order_in.position] = order_in
+        elif type_code == CANCEL:
+            order_num = order_in.order_to_cancel
+            if self.orders.pop(order_num, None) is None and self.stops.pop(order_num, None) is None:
+                self.book.cancel_order_processor(order_num)
+        elif type_code == AMEND:
+            self.amend(order_in)
+        elif type_code == STOP:
+            if order_in.side_code is None:
+                raise ValueError('Bad Inputs!')
+            self.stops[order_in.position] = order_in
+        else:
+            raise ValueError('Bad Inputs!')
+
+    def amend(self, order_in):
+        """Amend a collected order or held stop -- it keeps its arrival order unless its price changes or its volume
+        goes up"""
+        held = self.orders
+        order = held.get(order_in.order_to_amend)
+        if order is None:
+            held = self.stops
+            order = held.get(order_in.order_to_amend)
+        if order is None:
+            # Resting stop orders stay on the book during the auction
+            self.book.amend_order_processor(order_in)
+            return None
+        if order_in.volume <= 0:
+            raise ValueError('Bad Inputs!')
+        if order_in.price == order.price and order_in.volume <= order.volume:
+            order.volume = order.volume_to_trade = order_in.volume
+            return None
+        del held[order.position]
+        replacement = Order(order_in.position, [order.type, order.side, order_in.volume, order_in.price])
+        held[replacement.position] = replacement
+
+    def clearing_price(self):
+        """Return (price, volume) maximizing executable volume, or (None, 0) when nothing crosses.
+        Ties go to the smallest imbalance and then to the price closest to the last trade."""
+        market_buy = market_sell = 0
+        buy_at = {}
+        sell_at = {}
+        for order in self.orders.values():
+            is_buy = order.side_code == BUY
+            if order.type_code == MARKET:
+                if is_buy:
+                    market_buy += order.volume
+                else:
+                    market_sell += order.volume
+            elif is_buy:
+                buy_at[order.price] = buy_at.get(order.price, 0) + order.volume
+            else:
+                sell_at[order.price] = sell_at.get(order.price, 0) + order.volume
+        prices = sorted(buy_at.keys() | sell_at.keys())
+        prev_trade = self.book.find_prev_trade()
+        if not prices:
+            if prev_trade is None:
+                return None, 0
+            prices = [prev_trade.price]
+        # Cumulative demand from the highest price down and supply from the lowest price up
+        demand = list(accumulate(reversed([buy_at.get(price, 0) for price in prices]), initial=market_buy))[:0:-1]
+        supply = list(accumulate([sell_at.get(price, 0) for price in prices], initial=market_sell))[1:]
+        executable = list(map(min, demand, supply))
+        volume = max(executable)
+        if volume == 0:
+            return None, 0
+        reference = prev_trade.price if prev_trade is not None else (prices[0] + prices[-1]) / 2
+        best = min((abs(demand[i] - supply[i]), abs(prices[i] - reference), i)
+                   for i in range(len(prices)) if executable[i] == volume)
+        return prices[best[2]], volume
+
+    def uncross(self):
+        """End the auction -- fill at the clearing price, rest the limit remainders on the book and release stops"""
+        book = self.book
+        book.auction = None
+        book.sink.on_auction(False)
+        price, volume = self.clearing_price()
+        buys = []
+        sells = []
+        if price is not None:
+            # Market orders first, then price priority, then arrival
+            for order in self.orders.values():
+                is_market = order.type_code == MARKET
+                if order.side_code == BUY:
+                    if is_market or order.price >= price:
+                        buys.append((not is_market, -order.price, order.position, order))
+                elif is_market or order.price <= price:
+                    sells.append((not is_market, order.price, order.position, order))
+            buys.sort(key=lambda item: item[:3])
+            sells.sort(key=lambda item: item[:3])
+            self.fill([item[3] for item in buys], [item[3] for item in sells], price, volume)
+        remainders = {book.buy_queue: [], book.sell_queue: []}
+        for order in self.orders.values():
+            if order.volume_to_trade == 0:
+                continue
+            if order.type_code == MARKET:
+                logging.warning(' Market order %s unfilled at the end of the auction', order.position)
+            elif order.side_code == BUY:
+                remainders[book.buy_queue].append((order.price, order.position, order.volume_to_trade))
+            else:
+                remainders[book.sell_queue].append((order.price, order.position, order.volume_to_trade))
+        # The queues were emptied by start, so the remainders are bulk loaded rather than added one at a time
+        for q, orders in remainders.items():
+            q.load_orders(orders)
+            for order_price, order_id, order_volume in orders:
+                q.sink.on_add(q, order_price, order_id, order_volume)
+        for order in self.stops.values():
+            book.stop_order_processor(order)
+        self.orders = {}
+        self.stops = {}
+        book.stop_trigger()
+        return price, volume
+
+    def fill(self, buys, sells, price, volume):
+        """Walk both priority-ordered sides once, trading volume shares at price"""
+        trade_book = self.book.trade_book
+        i = j = 0
+        while volume > 0:
+            buy = buys[i]
+            sell = sells[j]
+            shares = min(buy.volume_to_trade, sell.volume_to_trade, volume)
+            # The later order of the pair is reported as the incoming one
+            if buy.position > sell.position:
+                trade_book.create_trade(price, shares, buy.position, sell.position)
+            else:
+                trade_book.create_trade(price, shares, sell.position, buy.position)
+            buy.volume_to_trade -= shares
+            sell.volume_to_trade -= shares
+            volume -= shares
+            if buy.volume_to_trade == 0:
+                i += 1
+            if sell.volume_to_trade == 0:
+                j += 1
+
+
+def auction_orders(num_orders, seed=0, mid_price=100.0, spread_ticks=50, tick_size=0.01):
+    """Limit and market orders scattered on both sides of mid_price, as collected for an opening auction"""
+    rng = random.Random(seed)
+    orders = []
+    for position in range(1, num_orders + 1):
+        side = rng.choice(['BUY', 'SELL'])
+        if rng.random() < 0.05:
+            orders.append(Order(position, ['Market', side, rng.randint(1, 100), 0.0]))
+        else:
+            price = round(mid_price + rng.randint(-spread_ticks, spread_ticks) * tick_size, 8)
+            orders.append(Order(position, ['Limit', side, rng.randint(1, 100), price]))
+    return orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a call auction with continuous matching of the same orders')
+    parser.add_argument('--orders', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    orders = auction_orders(args.orders, args.seed)
+    book = OrderBook(sink=NullSink())
+    start = time.perf_counter()
+    for order in orders:
+        book.order_sorter(order)
+    continuous = time.perf_counter() - start
+    prices = {trade.price for trade in book.trade_book.trade_list}
+    print('continuous {:8.3f}s  {:>7} trades at {} prices'.format(continuous, len(book.trade_book), len(prices)))
+    orders = auction_orders(args.orders, args.seed)
+    book = OrderBook(sink=NullSink())
+    start = time.perf_counter()
+    auction = CallAuction(book)
+    auction.start()
+    for order in orders:
+        book.order_sorter(order)
+    price, volume = auction.uncross()
+    elapsed = time.perf_counter() - start
+    print('auction    {:8.3f}s  {:>7} trades, {} shares at {}'.format(elapsed, len(book.trade_book), volume, price))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+from eventsink import NullSink
+from orderbook import OrderBook, Order, OrderQueue, PriceLevelQueue
+import argparse
+import logging
+import random
+import time
+
+
+def deep_book_orders(depth, num_aggressive, seed=0):
+    """Build a resting book of depth orders followed by aggressive market/limit orders and cancels"""
+    rng = random.Random(seed)
+    orders = []
+    for position in range(1, depth + 1):
+        if position % 2:
+            orders.append(Order(position, ['Limit', 'SELL', rng.randint(1, 100), 100.0 + rng.randint(1, 500) / 100]))
+        else:
+            orders.append(Order(position, ['Limit', 'BUY', rng.randint(1, 100), 100.0 - rng.randint(1, 500) / 100]))
+    for position in range(depth + 1, depth + num_aggressive + 1):
+        roll = rng.random()
+        side = rng.choice(['BUY', 'SELL'])
+        if roll < 0.4:
+            orders.append(Order(position, ['Market', side, rng.randint(1, 150), 0.0]))
+        elif roll < 0.7:
+            orders.append(Order(position, ['Cancel', 'na', rng.randint(1, depth), 0.0]))
+        else:
+            price = 100.0 + rng.randint(-50, 50) / 100
+            orders.append(Order(position, ['Limit', side, rng.randint(1, 150), price]))
+    return orders
+
+
+def run(queue_class, depth, num_aggressive):
+    """Time the resting and aggressive phases of the workload on one backend"""
+    orders = deep_book_orders(depth, num_aggressive)
+    book = OrderBook(queue_class, NullSink())
+    start = time.perf_counter()
+    for order in orders[:depth]:
+        book.order_sorter(order)
+    rest_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for order in orders[depth:]:
+        book.order_sorter(order)
+    match_time = time.perf_counter() - start
+    return rest_time, match_time, len(book.trade_book)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the heap and price level book backends')
+    parser.add_argument('--depth', type=int, default=100000, help='number of resting orders')
+    parser.add_argument('--orders', type=int, default=50000, help='number of aggressive orders and cancels')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    for queue_class in (OrderQueue, PriceLevelQueue):
+        rest_time, match_time, num_trades = run(queue_class, args.depth, args.orders)
+        print('{:16} rest {:8.3f}s  match {:8.3f}s  trades {}'.format(queue_class.__name__, rest_time,
+                                                                       match_time, num_trades))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+from eventsink import NullSink
+from heapq import heappush, heappop
+from orderbook import LIMIT, MARKET, STOP, CANCEL, AMEND, BUY, OrderBook, Order, Trade
+from workload import WorkloadConfig, generate_orders
+import argparse
+import gc
+import logging
+import random
+import time
+import tracemalloc
+
+
+class LegacyOrder:
+    def __init__(self, pos, in_list):
+        """Order as it was before __slots__ and type/side codes, kept for comparison"""
+        self.position = pos
+        self.type = in_list[0]
+        self.side = in_list[1]
+        if self.type.upper() == 'CANCEL':
+            self.order_to_cancel = in_list[2]
+        else:
+            self.volume = in_list[2]
+            self.volume_to_trade = in_list[2]
+        self.price = in_list[3]
+
+
+class LegacyTrade:
+    def __init__(self, trade_price, trade_vol, order_in_num, order_q_num):
+        """Trade as it was before __slots__, kept for comparison"""
+        self.shares = trade_vol
+        self.price = trade_price
+        self.order_in_num = order_in_num
+        self.order_q_num = order_q_num
+
+
+def legacy_dispatch(order):
+    """The string comparisons order_sorter and its processors made for every order"""
+    if order.type.upper() == 'LIMIT':
+        return order.side.upper() == 'SELL'
+    elif order.type.upper() == 'MARKET':
+        return order.side.upper() == 'BUY'
+    elif order.type.upper() == 'STOP':
+        return order.side.upper() == 'SELL'
+    elif order.type.upper() == 'CANCEL':
+        return None
+    elif order.type.upper() == 'AMEND':
+        return None
+
+
+def dispatch(order):
+    """The same decisions on the interned codes"""
+    if order.type_code == LIMIT:
+        return order.side_code != BUY
+    elif order.type_code == MARKET:
+        return order.side_code == BUY
+    elif order.type_code == STOP:
+        return order.side_code != BUY
+    elif order.type_code == CANCEL:
+        return None
+    elif order.type_code == AMEND:
+        return None
+
+
+def order_fields(n, seed, tick_size=None):
+    """n limit/market order field lists priced in integer ticks or, with tick_size, in float prices of those ticks"""
+    rng = random.Random(seed)
+    fields = []
+    for _ in range(n):
+        ticks = 10000 + rng.randint(-50, 50)
+        price = ticks if tick_size is None else round(ticks * tick_size, 8)
+        fields.append([rng.choice(['Limit', 'Market']), rng.choice(['BUY', 'SELL']), rng.randint(1, 100), price])
+    return fields
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def allocated(func, *args):
+    """Bytes still allocated by func(*args) while its result is alive"""
+    gc.collect()
+    tracemalloc.start()
+    result = func(*args)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def heap_churn(keys):
+    """Push every [key, id, volume] entry onto a heap and pop them all, as OrderQueue does"""
+    pq = []
+    for i, key in enumerate(keys):
+        heappush(pq, [key, i, 100])
+    while pq:
+        heappop(pq)
+
+
+def matching(in_ticks, num_orders, seed):
+    """Orders per second through an OrderBook on the mixed workload"""
+    config = WorkloadConfig(num_orders=num_orders, seed=seed, in_ticks=in_ticks)
+    orders = list(generate_orders(config))
+    book = OrderBook(sink=NullSink(), tick_size=config.tick_size if in_ticks else None)
+    elapsed, _ = timed(lambda: [book.order_sorter(order) for order in orders])
+    return num_orders / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the compact Order/Trade records with the legacy ones')
+    parser.add_argument('--orders', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    n = args.orders
+    float_fields = order_fields(n, args.seed, 0.01)
+    tick_fields = order_fields(n, args.seed)
+
+    def build(cls, fields):
+        return [cls(position, in_list) for position, in_list in enumerate(fields, 1)]
+
+    def build_trades(cls, fields):
+        return [cls(in_list[3], in_list[2], position, position) for position, in_list in enumerate(fields, 1)]
+
+    # Legacy and compact records get the same float prices, and the float/ticks rows compare the price types alone
+    print('{:32} {:>12} {:>12}'.format('', 'legacy', 'compact'))
+    legacy_bytes = allocated(build, LegacyOrder, float_fields)
+    compact_bytes = allocated(build, Order, float_fields)
+    print('{:32} {:>12.1f} {:>12.1f}'.format('Order bytes', legacy_bytes / n, compact_bytes / n))
+    legacy_bytes = allocated(build_trades, LegacyTrade, float_fields)
+    compact_bytes = allocated(build_trades, Trade, float_fields)
+    print('{:32} {:>12.1f} {:>12.1f}'.format('Trade bytes', legacy_bytes / n, compact_bytes / n))
+    legacy_time, legacy_orders = timed(build, LegacyOrder, float_fields)
+    compact_time, compact_orders = timed(build, Order, float_fields)
+    print('{:32} {:>12.3f} {:>12.3f}'.format('Order build us', legacy_time / n * 1e6, compact_time / n * 1e6))
+    legacy_time, _ = timed(lambda: [legacy_dispatch(order) for order in legacy_orders])
+    compact_time, _ = timed(lambda: [dispatch(order) for order in compact_orders])
+    print('{:32} {:>12.3f} {:>12.3f}'.format('dispatch us', legacy_time / n * 1e6, compact_time / n * 1e6))
+    # Prices are allocated with the field lists, not the records, so the price types are compared on the field lists
+    float_bytes = allocated(order_fields, n, args.seed, 0.01)
+    tick_bytes = allocated(order_fields, n, args.seed)
+    print('{:32} {:>12.1f} {:>12.1f}'.format('field list bytes float/ticks', float_bytes / n, tick_bytes / n))
+    float_time, _ = timed(heap_churn, [-in_list[3] for in_list in float_fields])
+    tick_time, _ = timed(heap_churn, [-in_list[3] for in_list in tick_fields])
+    print('{:32} {:>12.3f} {:>12.3f}'.format('heap push+pop us float/ticks', float_time / n * 1e6, tick_time / n * 1e6))
+    print('{:32} {:>12,.0f} {:>12,.0f}'.format('matching orders/sec float/ticks', matching(False, n, args.seed),
+                                                   matching(True, n, args.seed)))
+
+
+if __name__ == "__main__":
+    main()
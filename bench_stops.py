@@ -0,0 +1,50 @@
+from eventsink import NullSink
+from orderbook import OrderBook, Order
+import argparse
+import logging
+import random
+import time
+
+
+def clustered_stop_orders(num_stops, depth, seed=0):
+    """Resting liquidity around 100 with num_stops buy and sell stops clustered within 50 cents of the market"""
+    rng = random.Random(seed)
+    orders = []
+    position = 0
+    for i in range(depth):
+        position += 1
+        orders.append(Order(position, ['Limit', 'SELL', rng.randint(1, 20), 100.01 + i % 500 / 100]))
+        position += 1
+        orders.append(Order(position, ['Limit', 'BUY', rng.randint(1, 20), 99.99 - i % 500 / 100]))
+    for i in range(num_stops):
+        position += 1
+        if i % 2:
+            orders.append(Order(position, ['Stop', 'BUY', rng.randint(1, 5), 100.01 + rng.randint(0, 49) / 100]))
+        else:
+            orders.append(Order(position, ['Stop', 'SELL', rng.randint(1, 5), 99.99 - rng.randint(0, 49) / 100]))
+    return orders, position
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time a stop cascade through thousands of clustered stop orders')
+    parser.add_argument('--stops', type=int, default=10000, help='number of stop orders')
+    parser.add_argument('--depth', type=int, default=5000, help='resting orders per side')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    orders, position = clustered_stop_orders(args.stops, args.depth)
+    book = OrderBook(sink=NullSink())
+    for order in orders:
+        book.order_sorter(order)
+    resting_stops = book.buy_stop_queue.num_orders + book.sell_stop_queue.num_orders
+    num_trades = len(book.trade_book)
+    # Sweep the ask side up through the buy stops -- every triggered stop pushes the price further
+    start = time.perf_counter()
+    book.order_sorter(Order(position + 1, ['Market', 'BUY', 500, 0.0]))
+    elapsed = time.perf_counter() - start
+    triggered = resting_stops - book.buy_stop_queue.num_orders - book.sell_stop_queue.num_orders
+    print('{} of {} stops triggered, {} trades in {:.3f}s'.format(triggered, resting_stops,
+                                                                  len(book.trade_book) - num_trades, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+from eventsink import NullSink
+from orderbook import OrderBook, OrderQueue, PriceLevelQueue
+from tradestore import ColumnarTradeBook
+from workload import SCENARIOS, generate_orders, scenario_config
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+BACKENDS = {'heap': OrderQueue, 'level': PriceLevelQueue}
+TRADE_STORES = {'list': lambda integer_prices: None,
+                'columnar': lambda integer_prices: ColumnarTradeBook(integer_prices=integer_prices)}
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def run_scenario(name, num_orders, backend='heap', trade_store='list', seed=0, in_ticks=False):
+    """Run one scenario, returning throughput, per-type latency percentiles in microseconds and peak memory in MB"""
+    config = scenario_config(name, num_orders, seed)
+    config.in_ticks = in_ticks
+    tick_size = config.tick_size if in_ticks else None
+    orders = list(generate_orders(config))
+    book = OrderBook(BACKENDS[backend], NullSink(), TRADE_STORES[trade_store](in_ticks), tick_size)
+    latencies = {}
+    clock = time.perf_counter_ns
+    start = clock()
+    for order in orders:
+        order_start = clock()
+        book.order_sorter(order)
+        latencies.setdefault(order.type.upper(), []).append(clock() - order_start)
+    elapsed = (clock() - start) / 1e9
+    result = {'orders': len(orders), 'trades': len(book.trade_book), 'orders_per_sec': len(orders) / elapsed,
+              'latency_us': {}}
+    for order_type, values in sorted(latencies.items()):
+        values.sort()
+        result['latency_us'][order_type] = {'count': len(values),
+                                            'p50': percentile(values, 0.5) / 1e3,
+                                            'p99': percentile(values, 0.99) / 1e3,
+                                            'p999': percentile(values, 0.999) / 1e3}
+    # Second pass for memory -- only allocations made by the book and its trade store are traced
+    orders = list(generate_orders(config))
+    tracemalloc.start()
+    book = OrderBook(BACKENDS[backend], NullSink(), TRADE_STORES[trade_store](in_ticks), tick_size)
+    for order in orders:
+        book.order_sorter(order)
+    result['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result
+
+
+def compare(results, baseline, tolerance):
+    """Return a description of every metric that is worse than baseline by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['orders_per_sec'] < base['orders_per_sec'] * (1 - tolerance):
+            regressions.append('{}: throughput {:,.0f} < baseline {:,.0f}'.format(
+                name, result['orders_per_sec'], base['orders_per_sec']))
+        if result['peak_mb'] > base['peak_mb'] * (1 + tolerance):
+            regressions.append('{}: peak memory {:.1f}MB > baseline {:.1f}MB'.format(
+                name, result['peak_mb'], base['peak_mb']))
+        for order_type, latency in result['latency_us'].items():
+            base_latency = base['latency_us'].get(order_type)
+            if base_latency is None:
+                continue
+            for key in ('p50', 'p99', 'p999'):
+                if latency[key] > base_latency[key] * (1 + tolerance):
+                    regressions.append('{}: {} {} {:.1f}us > baseline {:.1f}us'.format(
+                        name, order_type, key, latency[key], base_latency[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark OrderBook on synthetic order flow')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--orders', type=int, default=100000, help='orders per scenario after any prefill')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='heap')
+    parser.add_argument('--trade-store', choices=sorted(TRADE_STORES), default='list')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ticks', action='store_true', help='price orders in integer ticks instead of floats')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results to a baseline file')
+    parser.add_argument('--compare', metavar='PATH', help='flag regressions against a baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown before flagging')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    results = {}
+    for name in args.scenarios:
+        result = results[name] = run_scenario(name, args.orders, args.backend, args.trade_store, args.seed, args.ticks)
+        print('{:14} {:>10,.0f} orders/sec  {:>8} trades  peak {:7.1f}MB'.format(
+            name, result['orders_per_sec'], result['trades'], result['peak_mb']))
+        for order_type, latency in result['latency_us'].items():
+            print('    {:7} n={:<8} p50 {:8.1f}us  p99 {:8.1f}us  p999 {:8.1f}us'.format(
+                order_type, latency['count'], latency['p50'], latency['p99'], latency['p999']))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from collections import deque
+import logging
+
+# Event codes used by RingBufferSink records
+ORDER, TRADE, ADD, REMOVE, REDUCE, CANCEL, STOP_TRIGGER, AMEND = range(8)
+
+
+class EventSink:
+    def __init__(self):
+        """Receives matching events from an OrderBook -- every event is ignored unless a subclass overrides it"""
+        pass
+
+    def on_order(self, order_in):
+        """An order has arrived at order_sorter"""
+        pass
+
+    def on_order_done(self, order_in):
+        """order_sorter has finished with an order, including any stop orders it triggered"""
+        pass
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        """Shares of the incoming order traded against a resting order"""
+        pass
+
+    def on_add(self, queue, price, order_id, volume):
+        """An order was added to queue"""
+        pass
+
+    def on_remove(self, queue, price, order_id, volume):
+        """The extreme order was popped off queue"""
+        pass
+
+    def on_reduce(self, queue, price, order_id, volume):
+        """volume shares were filled in place from a resting order that stays on queue"""
+        pass
+
+    def on_cancel(self, queue, price, order_id, volume):
+        """A resting order was removed from queue before being filled"""
+        pass
+
+    def on_stop_trigger(self, side, order_id, volume):
+        """A stop order was triggered and is about to execute as a market order"""
+        pass
+
+    def on_amend(self, queue, price, order_id, volume):
+        """volume shares were taken off a resting order that keeps its place on queue"""
+        pass
+
+    def on_auction(self, running):
+        """An auction phase started (running) or uncrossed -- see auction.CallAuction"""
+        pass
+
+
+class NullSink(EventSink):
+    """Discards every event"""
+    pass
+
+
+class RingBufferSink(EventSink):
+    def __init__(self, capacity=65536):
+        """Keeps the last capacity events as compact tuples that start with an event code"""
+        EventSink.__init__(self)
+        self.events = deque(maxlen=capacity)
+
+    def on_order(self, order_in):
+        self.events.append((ORDER, order_in.position))
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        self.events.append((TRADE, price, shares, order_in_num, order_q_num))
+
+    def on_add(self, queue, price, order_id, volume):
+        self.events.append((ADD, queue.name, price, order_id, volume))
+
+    def on_remove(self, queue, price, order_id, volume):
+        self.events.append((REMOVE, queue.name, price, order_id, volume))
+
+    def on_reduce(self, queue, price, order_id, volume):
+        self.events.append((REDUCE, queue.name, price, order_id, volume))
+
+    def on_cancel(self, queue, price, order_id, volume):
+        self.events.append((CANCEL, queue.name, price, order_id, volume))
+
+    def on_stop_trigger(self, side, order_id, volume):
+        self.events.append((STOP_TRIGGER, side, order_id, volume))
+
+    def on_amend(self, queue, price, order_id, volume):
+        self.events.append((AMEND, queue.name, price, order_id, volume))
+
+    def trades(self):
+        """Return the buffered trades as (price, shares, order_in_num, order_q_num) tuples"""
+        return [event[1:] for event in self.events if event[0] == TRADE]
+
+    def clear(self):
+        self.events.clear()
+
+
+class TeeSink(EventSink):
+    def __init__(self, *sinks):
+        """Forwards every event to each of sinks in turn"""
+        EventSink.__init__(self)
+        self.sinks = sinks
+
+    def on_order(self, order_in):
+        for sink in self.sinks:
+            sink.on_order(order_in)
+
+    def on_order_done(self, order_in):
+        for sink in self.sinks:
+            sink.on_order_done(order_in)
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        for sink in self.sinks:
+            sink.on_trade(price, shares, order_in_num, order_q_num)
+
+    def on_add(self, queue, price, order_id, volume):
+        for sink in self.sinks:
+            sink.on_add(queue, price, order_id, volume)
+
+    def on_remove(self, queue, price, order_id, volume):
+        for sink in self.sinks:
+            sink.on_remove(queue, price, order_id, volume)
+
+    def on_reduce(self, queue, price, order_id, volume):
+        for sink in self.sinks:
+            sink.on_reduce(queue, price, order_id, volume)
+
+    def on_cancel(self, queue, price, order_id, volume):
+        for sink in self.sinks:
+            sink.on_cancel(queue, price, order_id, volume)
+
+    def on_stop_trigger(self, side, order_id, volume):
+        for sink in self.sinks:
+            sink.on_stop_trigger(side, order_id, volume)
+
+    def on_amend(self, queue, price, order_id, volume):
+        for sink in self.sinks:
+            sink.on_amend(queue, price, order_id, volume)
+
+    def on_auction(self, running):
+        for sink in self.sinks:
+            sink.on_auction(running)
+
+
+class LineSink(EventSink):
+    def __init__(self, stream=None, tick_size=None):
+        """Formats 'match ...' lines -- logged at ERROR level as before, or written to stream when one is given.
+        Queue activity is logged at INFO level and only formatted when INFO is enabled.  With tick_size, trade prices
+        are integer ticks and are printed as prices."""
+        EventSink.__init__(self)
+        self.stream = stream
+        self.tick_size = tick_size
+        self.logger = logging.getLogger()
+
+    def on_order(self, order_in):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  PROCESSING ORDER NUMBER %s', order_in.position)
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        if self.tick_size is not None:
+            price = price * self.tick_size
+        if self.stream is None:
+            self.logger.error('match %d %d %d %.2f', order_in_num, order_q_num, shares, price)
+        else:
+            self.stream.write('match %d %d %d %.2f\n' % (order_in_num, order_q_num, shares, price))
+
+    def on_add(self, queue, price, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  ADDING %s shares at $%s with #%s into %s', volume, price, order_id, queue.name)
+
+    def on_remove(self, queue, price, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  REMOVING %s shares at $%s with #%s from %s', volume, price, order_id, queue.name)
+
+    def on_reduce(self, queue, price, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  FILLING %s shares at $%s with #%s in %s', volume, price, order_id, queue.name)
+
+    def on_cancel(self, queue, price, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  CANCELLED order number: %s', order_id)
+
+    def on_stop_trigger(self, side, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  TRIGGERED %s stop order #%s for %s shares', side, order_id, volume)
+
+    def on_amend(self, queue, price, order_id, volume):
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('  AMENDED order number %s down by %s shares in %s', order_id, volume, queue.name)
+
+
+NULL_SINK = NullSink()
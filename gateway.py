@@ -0,0 +1,287 @@
+from eventsink import EventSink, NullSink, TeeSink
+from orderbook import CANCEL, AMEND, OrderBook, Order, to_ticks
+from orderstream import order_fields
+from persistence import SIDE_NAMES, TYPE_CODES, TYPE_NAMES
+from workload import WorkloadConfig, generate_orders
+import argparse
+import asyncio
+import logging
+import struct
+import time
+
+# Binary framing: requests are fixed-size order frames, responses an ack frame followed by its trade frames.  An ack
+# for order number REJECTED answers a rejected order, and one for FILLS carries trades of a client's resting orders
+# made by another client's order.
+REQUEST_FRAME = struct.Struct('<BBqd')
+ACK_FRAME = struct.Struct('<qI')
+TRADE_FRAME = struct.Struct('<qqqd')
+REJECTED, FILLS = 0, -1
+# A request frame has no room for the new volume of an amend, so amends are only accepted as text
+FRAME_TYPE_NAMES = {code: name for code, name in TYPE_NAMES.items() if name != 'Amend'}
+
+
+class TradeCollector(EventSink):
+    def __init__(self):
+        """Collects the trades of the order currently being matched"""
+        EventSink.__init__(self)
+        self.trades = []
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        self.trades.append((order_in_num, order_q_num, shares, price))
+
+
+def parse_fields(line, tick_size=None):
+    """Turn a 'type side volume price' line into Order fields, raising ValueError for bad input.
+    With tick_size the price is converted to integer ticks."""
+    fields = line.split()
+    if not fields or fields[0].upper() not in TYPE_CODES:
+        raise ValueError('Bad Inputs!')
+    if len(fields) != (5 if fields[0].upper() == 'AMEND' else 4):
+        raise ValueError('Bad Inputs!')
+    return order_fields(fields, tick_size)
+
+
+class OrderGateway:
+    def __init__(self, book=None, max_pending=10000, batch_size=256, binary=False):
+        """Accepts orders from many TCP clients and feeds them to one matching task through a bounded queue.
+
+        When max_pending orders are waiting, client readers stop reading so TCP pushes back on the senders.  Every
+        order is answered with an ack carrying its order number and the trades of the client's orders it made, in the
+        text format of stock_orders.txt/'match ...' lines or in fixed binary frames.  Trades of resting orders are also
+        sent to the client that placed them, and rejected orders get an error and no order number.  Clients always
+        send and receive prices -- for a book with a tick_size they are converted to and from integer ticks."""
+        self.book = OrderBook(sink=NullSink()) if book is None else book
+        self.collector = TradeCollector()
+        self.book.set_sink(TeeSink(self.book.sink, self.collector))
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.binary = binary
+        self.queue = None
+        self.position = 0
+        # Client writer of every order number that may still trade
+        self.owners = {}
+        self.server = None
+        self.matcher = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Start listening and matching, returning the bound port"""
+        self.queue = asyncio.Queue(self.max_pending)
+        self.matcher = asyncio.ensure_future(self.match_loop())
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.matcher.cancel()
+
+    async def handle_client(self, reader, writer):
+        """Read orders from one client until it disconnects"""
+        try:
+            while True:
+                if self.binary:
+                    try:
+                        frame = await reader.readexactly(REQUEST_FRAME.size)
+                    except asyncio.IncompleteReadError:
+                        break
+                    type_code, side_code, volume, price = REQUEST_FRAME.unpack(frame)
+                    if type_code not in FRAME_TYPE_NAMES or side_code not in SIDE_NAMES:
+                        fields = ValueError('Bad Inputs!')
+                    else:
+                        if self.book.tick_size is not None:
+                            price = to_ticks(price, self.book.tick_size)
+                        fields = [FRAME_TYPE_NAMES[type_code], SIDE_NAMES[side_code], volume, price]
+                else:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    try:
+                        fields = parse_fields(line.decode('ascii'), self.book.tick_size)
+                    except ValueError as e:
+                        fields = e
+                # Requests that fail to parse are queued as their error, so match_loop answers every request in order.
+                # Blocks while the queue is full, which stops this client being read.
+                await self.queue.put((writer, fields))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def match_loop(self):
+        """Drain the order queue in micro-batches of up to batch_size orders"""
+        queue = self.queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            for writer, fields in batch:
+                if isinstance(fields, ValueError):
+                    self.reject(writer, fields)
+                    continue
+                position = self.position + 1
+                trades = self.collector.trades
+                trades.clear()
+                try:
+                    order_in = Order(position, fields)
+                    self.owners[position] = writer
+                    self.book.order_sorter(order_in)
+                except (ValueError, IndexError) as e:
+                    # order_sorter rejects an order before changing the book, so its number is given to the next one
+                    logging.warning(' Order %s rejected: %s', position, e)
+                    self.owners.pop(position, None)
+                    self.reject(writer, e)
+                    continue
+                self.position = position
+                # Every trade goes to the clients of both its orders -- a triggered stop or a resting order may
+                # belong to a client other than the one whose order set it off
+                responses = {writer: []}
+                owners = self.owners
+                for trade in trades:
+                    in_owner = owners.get(trade[0])
+                    q_owner = owners.get(trade[1])
+                    if in_owner is not None:
+                        responses.setdefault(in_owner, []).append(trade)
+                    if q_owner is not None and q_owner is not in_owner:
+                        responses.setdefault(q_owner, []).append(trade)
+                for client, client_trades in responses.items():
+                    if not client.is_closing():
+                        self.respond(client, position if client is writer else None, client_trades)
+                self.release(order_in, trades)
+            # Let client readers refill the queue before the next batch
+            await asyncio.sleep(0)
+
+    def respond(self, writer, position, trades):
+        """Send the ack of order number position with its trades -- only the trades when position is None"""
+        tick_size = self.book.tick_size
+        if tick_size is not None:
+            trades = [(order_in_num, order_q_num, shares, price * tick_size)
+                      for order_in_num, order_q_num, shares, price in trades]
+        if self.binary:
+            response = [ACK_FRAME.pack(FILLS if position is None else position, len(trades))]
+            response.extend(TRADE_FRAME.pack(*trade) for trade in trades)
+            writer.write(b''.join(response))
+        else:
+            response = [] if position is None else ['ack %d %d\n' % (position, len(trades))]
+            response.extend('match %d %d %d %.2f\n' % trade for trade in trades)
+            writer.write(''.join(response).encode('ascii'))
+
+    def reject(self, writer, error):
+        if writer.is_closing():
+            return None
+        if self.binary:
+            writer.write(ACK_FRAME.pack(REJECTED, 0))
+        else:
+            writer.write('error {}\n'.format(error).encode('ascii'))
+
+    def release(self, order_in, trades):
+        """Forget the owners of the orders touched by order_in that can no longer trade"""
+        order_nums = {order_in.position}
+        if order_in.type_code == CANCEL:
+            order_nums.add(order_in.order_to_cancel)
+        elif order_in.type_code == AMEND:
+            order_nums.add(order_in.order_to_amend)
+        for trade in trades:
+            order_nums.add(trade[0])
+            order_nums.add(trade[1])
+        order_index = self.book.order_index
+        for order_num in order_nums:
+            if order_num not in order_index:
+                self.owners.pop(order_num, None)
+
+
+async def load_client(host, port, orders, binary, latencies):
+    """Send orders one at a time, recording the round trip of each until its full response has arrived"""
+    reader, writer = await asyncio.open_connection(host, port)
+    clock = time.perf_counter
+    for order in orders:
+        if binary:
+            side_code = 2 if order.side_code is None else order.side_code
+            volume = order.order_to_cancel if order.type_code == CANCEL else order.volume
+            request = REQUEST_FRAME.pack(order.type_code, side_code, volume, order.price)
+        else:
+            volume = order.order_to_cancel if order.type_code == CANCEL else order.volume
+            request = '{} {} {} {:.2f}\n'.format(order.type, order.side, volume, order.price).encode('ascii')
+        start = clock()
+        writer.write(request)
+        # Trades of this client's resting orders can arrive ahead of the ack
+        if binary:
+            while True:
+                position, num_trades = ACK_FRAME.unpack(await reader.readexactly(ACK_FRAME.size))
+                await reader.readexactly(TRADE_FRAME.size * num_trades)
+                if position != FILLS:
+                    break
+        else:
+            while True:
+                fields = (await reader.readline()).split()
+                if fields[0] == b'ack':
+                    for _ in range(int(fields[2])):
+                        await reader.readline()
+                    break
+                if fields[0] == b'error':
+                    break
+        latencies.append(clock() - start)
+    writer.close()
+
+
+async def load_test(host, port, connection_counts, orders_per_connection, binary, seed=0):
+    """Run closed-loop clients at each connection count and print round-trip latency percentiles"""
+    for num_connections in connection_counts:
+        latencies = []
+        clients = []
+        for i in range(num_connections):
+            config = WorkloadConfig(num_orders=orders_per_connection, stop_ratio=0.0, cancel_ratio=0.0,
+                                    seed=seed + i)
+            clients.append(load_client(host, port, list(generate_orders(config)), binary, latencies))
+        start = time.perf_counter()
+        await asyncio.gather(*clients)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        n = len(latencies)
+        print('{:5} connections  {:>10,.0f} orders/sec  p50 {:8.1f}us  p99 {:8.1f}us  p999 {:8.1f}us'.format(
+            num_connections, n / elapsed, latencies[n // 2] * 1e6, latencies[min(int(n * 0.99), n - 1)] * 1e6,
+            latencies[min(int(n * 0.999), n - 1)] * 1e6))
+
+
+async def serve(args):
+    gateway = OrderGateway(max_pending=args.max_pending, batch_size=args.batch_size, binary=args.binary)
+    port = await gateway.start(args.host, args.port)
+    print('Listening on {}:{}'.format(args.host, port))
+    await gateway.server.serve_forever()
+
+
+async def run_load_test(args):
+    gateway = None
+    port = args.port
+    if args.local:
+        gateway = OrderGateway(max_pending=args.max_pending, batch_size=args.batch_size, binary=args.binary)
+        port = await gateway.start(args.host, 0)
+    await load_test(args.host, port, args.connections, args.orders, args.binary)
+    if gateway is not None:
+        await gateway.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio order-entry gateway in front of OrderBook')
+    parser.add_argument('command', choices=['serve', 'loadtest'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--binary', action='store_true', help='use fixed binary frames instead of text lines')
+    parser.add_argument('--max-pending', type=int, default=10000, help='orders queued before clients are pushed back')
+    parser.add_argument('--batch-size', type=int, default=256, help='orders matched per micro-batch')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1, 10, 50, 100],
+                        help='loadtest connection counts')
+    parser.add_argument('--orders', type=int, default=1000, help='loadtest orders per connection')
+    parser.add_argument('--local', action='store_true', help='loadtest against a gateway started in-process')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.command == 'serve':
+        asyncio.run(serve(args))
+    else:
+        asyncio.run(run_load_test(args))
+
+
+if __name__ == "__main__":
+    main()
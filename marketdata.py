@@ -0,0 +1,94 @@
+from bisect import bisect_left, insort
+from eventsink import EventSink, TeeSink
+
+
+class MarketDataBook(EventSink):
+    def __init__(self, on_deltas=None):
+        """Aggregated L1/L2 depth of an OrderBook, kept up to date from its queue events.
+
+        After every order_sorter call the price levels whose volume changed are published as (side, price, volume)
+        deltas -- a volume of 0 means the level is gone.  on_deltas, if given, is called with each non-empty list."""
+        EventSink.__init__(self)
+        self.on_deltas = on_deltas
+        self.bids = {}
+        self.asks = {}
+        # Prices with volume, in ascending order -- best bid is last, best ask is first
+        self.bid_prices = []
+        self.ask_prices = []
+        self.sides = {}
+        self.changed = set()
+        self.last_deltas = []
+
+    def attach(self, book):
+        """Start following book, seeding the depth from the orders already resting on it"""
+        self.sides = {book.buy_queue: ('BUY', self.bids, self.bid_prices),
+                      book.sell_queue: ('SELL', self.asks, self.ask_prices)}
+        for q in (book.buy_queue, book.sell_queue):
+            for [price, _order_id, volume] in q.entries():
+                self.update_level(q, price, volume)
+        self.changed.clear()
+        book.set_sink(TeeSink(book.sink, self))
+
+    def update_level(self, queue, price, volume_change):
+        """Apply a volume change to one price level of queue, ignoring the stop queues"""
+        side = self.sides.get(queue)
+        if side is None:
+            return None
+        label, volumes, prices = side
+        volume = volumes.get(price, 0) + volume_change
+        if volume > 0:
+            if price not in volumes:
+                insort(prices, price)
+            volumes[price] = volume
+        elif price in volumes:
+            del volumes[price]
+            del prices[bisect_left(prices, price)]
+        self.changed.add((label, price))
+
+    def on_add(self, queue, price, order_id, volume):
+        self.update_level(queue, price, volume)
+
+    def on_remove(self, queue, price, order_id, volume):
+        self.update_level(queue, price, -volume)
+
+    def on_reduce(self, queue, price, order_id, volume):
+        self.update_level(queue, price, -volume)
+
+    def on_cancel(self, queue, price, order_id, volume):
+        self.update_level(queue, price, -volume)
+
+    def on_amend(self, queue, price, order_id, volume):
+        self.update_level(queue, price, -volume)
+
+    def on_order_done(self, order_in):
+        if not self.changed:
+            self.last_deltas = []
+            return None
+        deltas = []
+        for label, price in sorted(self.changed):
+            volumes = self.bids if label == 'BUY' else self.asks
+            deltas.append((label, price, volumes.get(price, 0)))
+        self.changed.clear()
+        self.last_deltas = deltas
+        if self.on_deltas is not None:
+            self.on_deltas(deltas)
+
+    def best_bid(self):
+        """Return (price, volume) of the highest bid, or None"""
+        if not self.bid_prices:
+            return None
+        price = self.bid_prices[-1]
+        return price, self.bids[price]
+
+    def best_ask(self):
+        """Return (price, volume) of the lowest ask, or None"""
+        if not self.ask_prices:
+            return None
+        price = self.ask_prices[0]
+        return price, self.asks[price]
+
+    def depth(self, n=10):
+        """Return the top n aggregated levels per side as ([(bid, volume), ...], [(ask, volume), ...]), best first"""
+        bids = [(price, self.bids[price]) for price in reversed(self.bid_prices[-n:])]
+        asks = [(price, self.asks[price]) for price in self.ask_prices[:n]]
+        return bids, asks
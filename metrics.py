@@ -0,0 +1,222 @@
+from bisect import bisect_left
+from eventsink import EventSink, NullSink, TeeSink
+from orderbook import OrderBook, OrderQueue, PriceLevelQueue
+from workload import SCENARIOS, generate_orders, scenario_config
+import argparse
+import logging
+import os
+import time
+
+# Latency buckets double from 1us to about 65ms, count buckets from 1 to 4096
+LATENCY_BUCKETS = [1e-6 * 2 ** i for i in range(17)]
+COUNT_BUCKETS = [2 ** i for i in range(13)]
+BACKENDS = {'heap': OrderQueue, 'level': PriceLevelQueue}
+
+
+class Histogram:
+    def __init__(self, bounds):
+        """Fixed-bucket histogram -- a value lands in the first bucket whose upper bound is at least the value"""
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Return (upper bound, observations at or below it) pairs, ending with float('inf')"""
+        pairs = []
+        total = 0
+        for bound, count in zip(self.bounds + [float('inf')], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def quantile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations, or None if empty"""
+        if self.count == 0:
+            return None
+        rank = fraction * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': self.cumulative()}
+
+
+class BookMetrics(EventSink):
+    def __init__(self):
+        """Opt-in instrumentation of an OrderBook, built entirely from its events.
+
+        Records order_sorter latency per order type, the price levels and resting orders swept by every aggressive
+        order (each triggered stop counts as its own aggressive order), the depth of each stop cascade and how many
+        partial fills popped a heap entry and added it back.  A book without a BookMetrics attached pays nothing."""
+        EventSink.__init__(self)
+        self.book = None
+        self.latency = {}
+        self.levels_swept = Histogram(COUNT_BUCKETS)
+        self.orders_swept = Histogram(COUNT_BUCKETS)
+        self.cascade_depth = Histogram(COUNT_BUCKETS)
+        self.readds = 0
+        self.clock = time.perf_counter
+        self.order_start = None
+        self.limit_queues = ()
+        # State of the aggressive order being matched
+        self.swept_prices = set()
+        self.num_swept = 0
+        self.num_triggered = 0
+        self.last_removed = None
+
+    def attach(self, book):
+        """Start instrumenting book, keeping its current sink"""
+        self.book = book
+        self.limit_queues = (book.buy_queue, book.sell_queue)
+        book.set_sink(TeeSink(book.sink, self))
+
+    def on_order(self, order_in):
+        self.swept_prices.clear()
+        self.num_swept = 0
+        self.num_triggered = 0
+        self.last_removed = None
+        # Taken last so the time of the sinks ahead of this one is not counted
+        self.order_start = self.clock()
+
+    def on_order_done(self, order_in):
+        elapsed = self.clock() - self.order_start
+        order_type = order_in.type.upper()
+        histogram = self.latency.get(order_type)
+        if histogram is None:
+            histogram = self.latency[order_type] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(elapsed)
+        self.end_sweep()
+        if self.num_triggered:
+            self.cascade_depth.observe(self.num_triggered)
+
+    def on_stop_trigger(self, side, order_id, volume):
+        # The triggered stop executes as a new aggressive order
+        self.end_sweep()
+        self.num_triggered += 1
+
+    def on_remove(self, queue, price, order_id, volume):
+        if queue in self.limit_queues:
+            self.swept_prices.add(price)
+            self.num_swept += 1
+            self.last_removed = (queue, order_id)
+
+    def on_reduce(self, queue, price, order_id, volume):
+        if queue in self.limit_queues:
+            self.swept_prices.add(price)
+            self.num_swept += 1
+
+    def on_add(self, queue, price, order_id, volume):
+        # OrderQueue.take_order fills part of an order by popping it and adding the leftover shares back
+        if self.last_removed is not None and self.last_removed == (queue, order_id):
+            self.readds += 1
+        self.last_removed = None
+
+    def end_sweep(self):
+        if self.num_swept:
+            self.levels_swept.observe(len(self.swept_prices))
+            self.orders_swept.observe(self.num_swept)
+        self.swept_prices.clear()
+        self.num_swept = 0
+        self.last_removed = None
+
+    def queue_sizes(self):
+        """Return {queue name: (stored entries, live orders, tombstones reclaimed so far)}.
+        Stored entries less live orders is the number of tombstones."""
+        if self.book is None:
+            return {}
+        return {q.name: (q.num_entries(), q.num_orders, q.num_reclaimed) for q in self.book.queue_list}
+
+    def snapshot(self):
+        """Return every metric as plain Python values"""
+        return {'latency_seconds': {name: h.snapshot() for name, h in sorted(self.latency.items())},
+                'levels_swept': self.levels_swept.snapshot(),
+                'orders_swept': self.orders_swept.snapshot(),
+                'stop_cascade_depth': self.cascade_depth.snapshot(),
+                'partial_fill_readds': self.readds,
+                'queues': {name: {'entries': entries, 'orders': orders, 'tombstones': entries - orders,
+                                  'reclaimed': reclaimed}
+                           for name, (entries, orders, reclaimed) in self.queue_sizes().items()}}
+
+    def prometheus_text(self, prefix='orderbook'):
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+
+        def histogram(name, help_text, histograms):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} histogram'.format(prefix, name))
+            for labels, h in histograms:
+                sep = ',' if labels else ''
+                for bound, total in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else '{:g}'.format(bound)
+                    lines.append('{}_{}_bucket{{{}{}le="{}"}} {}'.format(prefix, name, labels, sep, le, total))
+                braces = '{' + labels + '}' if labels else ''
+                lines.append('{}_{}_sum{} {:g}'.format(prefix, name, braces, h.sum))
+                lines.append('{}_{}_count{} {}'.format(prefix, name, braces, h.count))
+
+        histogram('order_latency_seconds', 'Time spent in order_sorter by order type.',
+                  [('type="{}"'.format(name), h) for name, h in sorted(self.latency.items())])
+        histogram('levels_swept', 'Price levels traded through per aggressive order.', [('', self.levels_swept)])
+        histogram('orders_swept', 'Resting orders traded against per aggressive order.', [('', self.orders_swept)])
+        histogram('stop_cascade_depth', 'Stop orders triggered per cascade.', [('', self.cascade_depth)])
+        lines.append('# HELP {}_partial_fill_readds_total Partial fills that popped a heap entry and added it back.'
+                     .format(prefix))
+        lines.append('# TYPE {}_partial_fill_readds_total counter'.format(prefix))
+        lines.append('{}_partial_fill_readds_total {}'.format(prefix, self.readds))
+        sizes = sorted(self.queue_sizes().items())
+        for name, help_text, index, kind in (
+                ('queue_entries', 'Entries stored by each queue, tombstones included.', 0, 'gauge'),
+                ('queue_orders', 'Live orders resting on each queue.', 1, 'gauge'),
+                ('queue_tombstones_reclaimed_total', 'Tombstones dropped from each queue.', 2, 'counter')):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_text))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for queue_name, size in sizes:
+                lines.append('{}_{}{{queue="{}"}} {}'.format(prefix, name, queue_name, size[index]))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='orderbook'):
+        """Write prometheus_text to path, replacing it atomically so a textfile collector never reads half a file"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text(prefix))
+        os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a synthetic scenario with metrics attached')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='mixed')
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='heap')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', metavar='PATH', help='write the metrics in Prometheus text format to PATH')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    book = OrderBook(BACKENDS[args.backend], NullSink())
+    metrics = BookMetrics()
+    metrics.attach(book)
+    for order in generate_orders(scenario_config(args.scenario, args.orders, args.seed)):
+        book.order_sorter(order)
+    snapshot = metrics.snapshot()
+    for name, latency in snapshot['latency_seconds'].items():
+        print('{:7} n={:<8} p50 <= {:8.1f}us  p99 <= {:8.1f}us'.format(
+            name, latency['count'], latency['p50'] * 1e6, latency['p99'] * 1e6))
+    for name in ('levels_swept', 'orders_swept', 'stop_cascade_depth'):
+        h = snapshot[name]
+        print('{:18} n={:<8} p50 <= {}  p99 <= {}'.format(name, h['count'], h['p50'], h['p99']))
+    print('partial_fill_readds {}'.format(snapshot['partial_fill_readds']))
+    for name, sizes in snapshot['queues'].items():
+        print('{:15} entries {:>8}  orders {:>8}  tombstones {:>8}  reclaimed {:>8}'.format(
+            name, sizes['entries'], sizes['orders'], sizes['tombstones'], sizes['reclaimed']))
+    if args.out:
+        metrics.write_prometheus(args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+from eventsink import NullSink
+from orderbook import OrderBook, Order
+from orderstream import order_fields, read_lines
+from queue import Empty
+import argparse
+import logging
+import multiprocessing
+import random
+import time
+import zlib
+
+# How long a blocking collect waits for a reply before checking whether a worker has died
+WORKER_POLL_SECONDS = 1.0
+
+
+def parse_symbol_order(line, tick_size=None):
+    """Split a 'SYMBOL type side volume price' line into the symbol and the Order fields -- None for blank lines.
+    With tick_size the price is converted to integer ticks."""
+    fields = line.split()
+    if not fields:
+        return None
+    return fields[0], order_fields(fields[1:], tick_size)
+
+
+def iter_symbol_orders(path, use_mmap=False, tick_size=None):
+    """Lazily yield (symbol, position, fields) for a mixed-symbol order file, numbering orders across the whole file"""
+    position = 0
+    for line in read_lines(path, use_mmap):
+        parsed = parse_symbol_order(line, tick_size)
+        if parsed is not None:
+            position += 1
+            yield parsed[0], position, parsed[1]
+
+
+def shard_of(symbol, num_workers):
+    """Stable assignment of a symbol to a worker"""
+    return zlib.crc32(symbol.encode()) % num_workers
+
+
+class SymbolRouter:
+    def __init__(self, queue_class=None, sink_factory=NullSink, tick_size=None):
+        """Keeps one OrderBook per symbol, creating books as new symbols arrive -- with tick_size, books that take
+        integer tick prices"""
+        self.queue_class = queue_class
+        self.sink_factory = sink_factory
+        self.tick_size = tick_size
+        self.books = {}
+        # Number of trades of each symbol already handed out by new_trades
+        self.trades_sent = {}
+
+    def book(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            book = self.books[symbol] = OrderBook(self.queue_class, self.sink_factory(), tick_size=self.tick_size)
+            self.trades_sent[symbol] = 0
+        return book
+
+    def order_sorter(self, symbol, order_in):
+        """Route an order to the book of its symbol"""
+        self.book(symbol).order_sorter(order_in)
+
+    def new_trades(self, symbols):
+        """Return {symbol: [(seq, price, shares, order_in_num, order_q_num), ...]} for trades not yet handed out"""
+        out = {}
+        for symbol in symbols:
+            trade_book = self.books[symbol].trade_book
+            sent = self.trades_sent[symbol]
+            num_trades = len(trade_book)
+            if num_trades > sent:
+                trades = out[symbol] = []
+                for seq in range(sent, num_trades):
+                    trade = trade_book[seq]
+                    trades.append((seq, trade.price, trade.shares, trade.order_in_num, trade.order_q_num))
+                self.trades_sent[symbol] = num_trades
+        return out
+
+
+def shard_worker(in_queue, out_queue, queue_class, tick_size=None):
+    """Process batches of (symbol, position, fields) until a None batch arrives, replying with the new trades and
+    the (symbol, position, error) of every order that was rejected"""
+    logging.basicConfig(level=logging.CRITICAL)
+    router = SymbolRouter(queue_class, tick_size=tick_size)
+    while True:
+        batch = in_queue.get()
+        if batch is None:
+            out_queue.put(None)
+            return
+        symbols = set()
+        errors = []
+        for symbol, position, fields in batch:
+            try:
+                router.order_sorter(symbol, Order(position, fields))
+            except Exception as e:
+                # A bad order must not take the worker, and every other symbol of its shard, down with it
+                errors.append((symbol, position, repr(e)))
+            if symbol in router.books:
+                symbols.add(symbol)
+        out_queue.put((router.new_trades(symbols), errors))
+
+
+class ShardedEngine:
+    def __init__(self, num_workers=None, batch_size=1024, queue_class=None, tick_size=None):
+        """Shards symbols across num_workers processes, each keeping its own SymbolRouter.
+        Orders are sent to workers in batches of batch_size and trades come back in per-symbol sequence order.
+        Rejected orders are listed in self.errors as (symbol, position, error).  tick_size is passed to every
+        SymbolRouter."""
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.batches = [[] for _ in range(self.num_workers)]
+        self.in_queues = [multiprocessing.Queue() for _ in range(self.num_workers)]
+        self.out_queue = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=shard_worker, args=(q, self.out_queue, queue_class, tick_size),
+                                                daemon=True)
+                        for q in self.in_queues]
+        self.trades = {}
+        self.errors = []
+        self.running = 0
+        for worker in self.workers:
+            worker.start()
+            self.running += 1
+
+    def submit(self, symbol, position, fields):
+        """Queue an order for the worker owning symbol -- fields are the Order fields, e.g. ['Limit', 'BUY', 5, 99.0]"""
+        shard = shard_of(symbol, self.num_workers)
+        batch = self.batches[shard]
+        batch.append((symbol, position, fields))
+        if len(batch) >= self.batch_size:
+            self.in_queues[shard].put(batch)
+            self.batches[shard] = []
+            self.collect()
+
+    def flush(self):
+        """Send every partially filled batch"""
+        for shard, batch in enumerate(self.batches):
+            if batch:
+                self.in_queues[shard].put(batch)
+                self.batches[shard] = []
+
+    def collect(self, block=False):
+        """Merge trade replies that have arrived into self.trades -- blocks until every worker has stopped if block.
+        Raises RuntimeError if a worker died without stopping, rather than waiting for it forever."""
+        while self.running:
+            try:
+                reply = self.out_queue.get(block, WORKER_POLL_SECONDS)
+            except Empty:
+                if not block:
+                    return
+                exit_codes = [worker.exitcode for worker in self.workers if worker.exitcode not in (None, 0)]
+                if exit_codes:
+                    self.running = 0
+                    raise RuntimeError('Shard workers died with exit codes {}'.format(exit_codes))
+                continue
+            if reply is None:
+                self.running -= 1
+                continue
+            trades_by_symbol, errors = reply
+            for symbol, trades in trades_by_symbol.items():
+                self.trades.setdefault(symbol, []).extend(trades)
+            self.errors.extend(errors)
+
+    def close(self):
+        """Flush the remaining orders, stop the workers and return {symbol: trades}"""
+        self.flush()
+        for q in self.in_queues:
+            q.put(None)
+        self.collect(block=True)
+        for worker in self.workers:
+            worker.join()
+        return self.trades
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def mixed_symbol_orders(num_orders, num_symbols, seed=0):
+    """Random limit/market/cancel flow spread evenly over num_symbols symbols"""
+    rng = random.Random(seed)
+    symbols = ['SYM{}'.format(i) for i in range(num_symbols)]
+    orders = []
+    for position in range(1, num_orders + 1):
+        symbol = rng.choice(symbols)
+        side = rng.choice(['BUY', 'SELL'])
+        roll = rng.random()
+        if roll < 0.2:
+            orders.append((symbol, position, ['Market', side, rng.randint(1, 50), 0.0]))
+        elif roll < 0.35:
+            orders.append((symbol, position, ['Cancel', 'na', rng.randint(1, position), 0.0]))
+        else:
+            orders.append((symbol, position, ['Limit', side, rng.randint(1, 50), 100.0 + rng.randint(-100, 100) / 100]))
+    return orders
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Match a mixed-symbol order flow across worker processes')
+    parser.add_argument('path', nargs='?', help="order file of 'SYMBOL type side volume price' lines "
+                                                "(a random flow is generated when omitted)")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='worker counts to time')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--orders', type=int, default=200000, help='size of the generated flow')
+    parser.add_argument('--symbols', type=int, default=200, help='symbols in the generated flow')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    if args.path:
+        orders = list(iter_symbol_orders(args.path))
+    else:
+        orders = mixed_symbol_orders(args.orders, args.symbols)
+    router = SymbolRouter()
+    start = time.perf_counter()
+    for symbol, position, fields in orders:
+        router.order_sorter(symbol, Order(position, fields))
+    elapsed = time.perf_counter() - start
+    print('in-process  {:>12,.0f} orders/sec'.format(len(orders) / elapsed))
+    for num_workers in args.workers:
+        start = time.perf_counter()
+        with ShardedEngine(num_workers, args.batch_size) as engine:
+            for symbol, position, fields in orders:
+                engine.submit(symbol, position, fields)
+        elapsed = time.perf_counter() - start
+        num_trades = sum(len(trades) for trades in engine.trades.values())
+        print('{:2} workers  {:>12,.0f} orders/sec  {} trades'.format(num_workers, len(orders) / elapsed, num_trades))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
-from orderbook import OrderBook, Order
+from orderbook import OrderBook
+from orderstream import ingest
 import logging
 import sys
 
@@ -6,18 +7,8 @@ import sys
 def main():
     logging.basicConfig(level=logging.ERROR)
     book = OrderBook()
-
-    with open('stock_orders.txt') as f:
-        content = f.readlines()
-    # you may also want to remove whitespace characters like `\n` at the end of each line
-    content = [x.strip().split() for x in content]
-    for position, order_input in enumerate(content):
-        order_input[2] = int(order_input[2])
-        order_input[3] = float(order_input[3])
-        order = Order(position + 1, order_input)
-        # print(order.__dict__)
-        book.order_sorter(order)
-        prev = book.find_prev_trade()
+    # Orders are parsed lazily and fed straight into the book, so memory stays flat for large files
+    ingest('stock_orders.txt', book)
 
 if __name__ == "__main__":
     main()
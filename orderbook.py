@@ -1,34 +1,80 @@
-from heapq import heappush, heappop
+from bisect import bisect_left, bisect_right, insort
+from collections import deque
+from eventsink import LineSink, NULL_SINK
+from heapq import heapify, heappush, heappop
 import logging
 import sys
 
+# Order type and side codes, looked up once when an Order is built
+LIMIT, MARKET, STOP, CANCEL, AMEND = range(5)
+TYPE_CODES = {'LIMIT': LIMIT, 'MARKET': MARKET, 'STOP': STOP, 'CANCEL': CANCEL, 'AMEND': AMEND}
+BUY, SELL = 0, 1
+SIDE_CODES = {'BUY': BUY, 'SELL': SELL}
+
+
+def to_ticks(price, tick_size):
+    """Convert a price to the whole number of tick_size ticks it is closest to"""
+    return round(price / tick_size)
+
 
 class OrderBook:
-    def __init__(self):
-        self.sell_queue = OrderQueue('sell_queue', 'sell')
-        self.buy_queue = OrderQueue('buy_queue', 'buy')
+    def __init__(self, queue_class=None, sink=None, trade_book=None, tick_size=None):
+        """queue_class selects the limit book backend -- OrderQueue (heap) or PriceLevelQueue.
+        sink receives every matching event and defaults to a LineSink printing the 'match ...' lines.
+        trade_book defaults to a TradeBook -- tradestore.ColumnarTradeBook is the compact alternative.
+        tick_size, when given, means order prices are integer ticks (see to_ticks) rather than float prices."""
+        if queue_class is None:
+            queue_class = OrderQueue
+        self.sell_queue = queue_class('sell_queue', 'sell')
+        self.buy_queue = queue_class('buy_queue', 'buy')
         self.sell_stop_queue = StopOrderQueue('sell_stop_queue', 'sell')
         self.buy_stop_queue = StopOrderQueue('buy_stop_queue', 'buy')
         self.queue_list = [self.buy_queue, self.sell_queue, self.buy_stop_queue, self.sell_stop_queue]
-        self.trade_book = TradeBook()
+        # Book-wide index from every resting order id to the queue holding it
+        self.order_index = {}
+        for q in self.queue_list:
+            q.order_index = self.order_index
+        self.trade_book = TradeBook() if trade_book is None else trade_book
+        # Triggered stop orders waiting to execute while a stop cascade is running
+        self.stop_pending = None
+        # Set by auction.CallAuction while an auction phase is collecting orders
+        self.auction = None
+        self.tick_size = tick_size
+        self.set_sink(LineSink(tick_size=tick_size) if sink is None else sink)
+
+    def set_sink(self, sink):
+        """Route the events of the book, its queues and its trade book to sink"""
+        self.sink = sink
+        for q in self.queue_list:
+            q.sink = sink
+        self.trade_book.sink = sink
 
     def order_sorter(self, order_in):
         """The initial piping to decided how to handle the order"""
-        logging.info('  PROCESSING ORDER NUMBER {}'.format(order_in.position))
-        if order_in.type.upper() == 'LIMIT':
+        self.sink.on_order(order_in)
+        if self.auction is not None:
+            # Orders are collected until the auction uncrosses
+            self.auction.collect(order_in)
+        elif order_in.type_code == LIMIT:
             self.limit_order_processor(order_in)
-        elif order_in.type.upper() == 'MARKET':
+            self.stop_trigger()
+        elif order_in.type_code == MARKET:
             self.market_order_processor(order_in)
-        elif order_in.type.upper() == 'STOP':
+            self.stop_trigger()
+        elif order_in.type_code == STOP:
             self.stop_order_processor(order_in)
-        elif order_in.type.upper() == 'CANCEL':
+        elif order_in.type_code == CANCEL:
             self.cancel_order_processor(order_in.order_to_cancel)
+        elif order_in.type_code == AMEND:
+            self.amend_order_processor(order_in)
+            self.stop_trigger()
         else:
             raise ValueError('Bad Inputs!')
+        self.sink.on_order_done(order_in)
 
     def limit_order_processor(self, order_in):
         """Processes limit orders handling leftover orders appropriately"""
-        if order_in.side.upper() == 'SELL':
+        if order_in.side_code == SELL:
             # Add order to book if the price is above current highest bid
             if self.buy_queue.num_orders == 0 or self.buy_queue.extreme_price() < order_in.price:
                 self.sell_queue.add_order(order_in.price, order_in.position, order_in.volume)
@@ -38,20 +84,17 @@ class OrderBook:
                         # Add leftover shares of order to relevant queue
                         self.sell_queue.add_order(order_in.price, order_in.position, order_in.volume_to_trade)
                         return None
-                    [buyer_price, buyer_number, buyer_volume] = self.buy_queue.pop_order()
-                    # How many shares were traded?
-                    trade_volume = self.shares_traded(order_in, buyer_price, buyer_number, buyer_volume)
+                    # Trade against the highest bid, leaving any of its leftover shares on the queue
+                    [buyer_price, buyer_number, trade_volume] = self.buy_queue.take_order(order_in.volume_to_trade)
                     self.trade_book.create_trade(buyer_price, trade_volume, order_in.position, buyer_number)
                     order_in.volume_to_trade = order_in.volume_to_trade - trade_volume
                     if self.buy_queue.num_orders == 0:
-                        self.stop_trigger()
                         return None
                     # Add leftover shares from order to queue
                     if order_in.volume_to_trade != 0 and order_in.price > self.buy_queue.extreme_price():
                         self.sell_queue.add_order(order_in.price, order_in.position, order_in.volume_to_trade)
                         order_in.volume_to_trade = 0
-                        self.stop_trigger()
-        elif order_in.side.upper() == 'BUY':
+        elif order_in.side_code == BUY:
             # Add order to book if the price is below current highest ask
             if self.sell_queue.num_orders == 0 or self.sell_queue.extreme_price() > order_in.price:
                 self.buy_queue.add_order(order_in.price, order_in.position, order_in.volume)
@@ -60,216 +103,191 @@ class OrderBook:
                     if self.sell_queue.num_orders == 0:
                         self.buy_queue.add_order(order_in.price, order_in.position, order_in.volume_to_trade)
                         return None
-                    [seller_price, seller_number, seller_volume] = self.sell_queue.pop_order()
-                    trade_volume = self.shares_traded(order_in, seller_price, seller_number, seller_volume)
+                    [seller_price, seller_number, trade_volume] = self.sell_queue.take_order(order_in.volume_to_trade)
                     order_in.volume_to_trade = order_in.volume_to_trade - trade_volume
                     self.trade_book.create_trade(seller_price, trade_volume, order_in.position, seller_number)
                     if self.sell_queue.num_orders == 0:
-                        self.stop_trigger()
                         return None
                     if order_in.volume_to_trade != 0 and order_in.price < self.sell_queue.extreme_price():
                         self.buy_queue.add_order(order_in.price, order_in.position, order_in.volume_to_trade)
                         order_in.volume_to_trade = 0
-                        self.stop_trigger()
         else:
             raise ValueError('Bad Inputs!')
 
-    def shares_traded(self, order_in, price, number, vol):
-        """Returns the volume of the trade"""
-        if order_in.side.upper() == 'BUY':
-            q = self.sell_queue
+    def cancel_order_processor(self, order_num):
+        """Looks up the queue holding the order to cancel in the order index"""
+        q = self.order_index.get(order_num)
+        if q is None:
+            logging.warning(' ORDER %s TO CANCEL NOT FOUND IN ANY QUEUE', order_num)
+            return None
+        q.remove_order(order_num)
+
+    def amend_order_processor(self, order_in):
+        """Amends a resting order.  Lowering the volume at the same price keeps the order's place in its queue.  Any
+        other change replaces it with a new order numbered after the amend, which joins the back of its price and
+        trades on arrival if the new price crosses the book."""
+        order_num = order_in.order_to_amend
+        q = self.order_index.get(order_num)
+        if q is None:
+            logging.warning(' ORDER %s TO AMEND NOT FOUND IN ANY QUEUE', order_num)
+            return None
+        if order_in.volume <= 0:
+            raise ValueError('Bad Inputs!')
+        [order_price, _order_id, order_volume] = q.get_order(order_num)
+        if order_in.price == order_price and order_in.volume <= order_volume:
+            q.reduce_order(order_num, order_in.volume)
+            return None
+        q.remove_order(order_num)
+        side = 'BUY' if q is self.buy_queue or q is self.buy_stop_queue else 'SELL'
+        if q is self.buy_stop_queue or q is self.sell_stop_queue:
+            self.stop_order_processor(Order(order_in.position, ['Stop', side, order_in.volume, order_in.price]))
+        else:
+            self.limit_order_processor(Order(order_in.position, ['Limit', side, order_in.volume, order_in.price]))
+
+    def cancel_orders(self, order_nums):
+        """Cancels every order in order_nums, returning how many were found"""
+        num_cancelled = 0
+        for order_num in order_nums:
+            q = self.order_index.get(order_num)
+            if q is not None:
+                q.remove_order(order_num)
+                num_cancelled += 1
+        return num_cancelled
+
+    def cancel_side(self, side, include_stops=False):
+        """Cancels every resting limit order on one side, and optionally its stop orders too"""
+        if side.upper() == 'SELL':
+            queues = [self.sell_queue, self.sell_stop_queue]
+        elif side.upper() == 'BUY':
+            queues = [self.buy_queue, self.buy_stop_queue]
         else:
+            raise ValueError('Bad Inputs!')
+        if not include_stops:
+            queues.pop()
+        return sum(q.remove_all() for q in queues)
+
+    def cancel_price_range(self, side, low_price, high_price):
+        """Cancels every resting limit order on one side priced between low_price and high_price inclusive"""
+        if side.upper() == 'SELL':
+            q = self.sell_queue
+        elif side.upper() == 'BUY':
             q = self.buy_queue
-        if vol > order_in.volume_to_trade:
-            trade_volume = order_in.volume_to_trade
-            # Add back leftover bid/ask order
-            q.add_order(price, number, vol - order_in.volume_to_trade)
         else:
-            trade_volume = vol
-        return trade_volume
+            raise ValueError('Bad Inputs!')
+        return q.remove_price_range(low_price, high_price)
 
-    def cancel_order_processor(self, order_num):
-        """Checks all queues for the order to cancel"""
-        for q in self.queue_list:
-            try:
-                q.remove_order(order_num)
-                logging.info('  CANCELLED order number: {}'.format(order_num))
-                return None
-            except KeyError:
-                logging.warning(' ORDER TO CANCEL NOT FOUND IN QUEUE')
-                continue
+    def cancel_all_stops(self):
+        """Cancels every resting stop order"""
+        return self.buy_stop_queue.remove_all() + self.sell_stop_queue.remove_all()
 
     def stop_order_processor(self, order_in):
         """Simply adds a stop order to its appropriate queue"""
-        if order_in.side.upper() == 'SELL':
+        if order_in.side_code == SELL:
             self.sell_stop_queue.add_order(order_in.price, order_in.position, order_in.volume)
-        elif order_in.side.upper() == 'BUY':
+        elif order_in.side_code == BUY:
             self.buy_stop_queue.add_order(order_in.price, order_in.position, order_in.volume)
         else:
             raise ValueError('Bad Inputs!')
 
     def market_order_processor(self, order_in):
         """Processes market orders handling leftover orders approriately"""
-        if order_in.side.upper() == 'BUY':
+        if order_in.side_code == BUY:
             q = self.sell_queue
         else:
             q = self.buy_queue
         # Check for any orders on the queue
         if q.num_orders == 0:
-            logging.warning(' No orders in {}...Cannot execute market order!'.format(q.name))
+            logging.warning(' No orders in %s...Cannot execute market order!', q.name)
             return None
         # Process market order until entire volume has been filled
-        if order_in.volume_to_trade == q.extreme_volume():
-            # Market order and extreme order on the queue have the same volume
-            [trade_price, buyer_number, trade_volume] = q.pop_order()
+        if order_in.volume_to_trade <= q.extreme_volume():
+            # Extreme order on the queue fills the whole market order -- any leftover shares stay on the queue
+            [trade_price, buyer_number, trade_volume] = q.take_order(order_in.volume_to_trade)
             self.trade_book.create_trade(trade_price, trade_volume, order_in.position, buyer_number)
-            self.stop_trigger()
-        elif order_in.volume_to_trade < q.extreme_volume():
-            # Partial filling of an order in the queue -- pop extreme order and then add back modified order
-            order_vol_remaining = q.extreme_volume() - order_in.volume_to_trade
-            [trade_price, buyer_number, _order_vol_orig] = q.pop_order()
-            self.trade_book.create_trade(trade_price, order_in.volume_to_trade, order_in.position, buyer_number)
-            q.add_order(trade_price, buyer_number, order_vol_remaining)
-            self.stop_trigger()
         else:
             # Multiple orders from the queue needed to satisfy the market order
             while order_in.volume_to_trade > 0:
                 if q.num_orders == 0:
                     return None
-                [q_price, q_number, q_volume] = q.pop_order()
-                if q_volume < order_in.volume_to_trade:
-                    trade_volume = q_volume
-                else:
-                    trade_volume = order_in.volume_to_trade
-                    q.add_order(q_price, q_number, q_volume - trade_volume)
+                [q_price, q_number, trade_volume] = q.take_order(order_in.volume_to_trade)
                 order_in.volume_to_trade = order_in.volume_to_trade - trade_volume
                 self.trade_book.create_trade(q_price, trade_volume, order_in.position, q_number)
-                #self.stop_trigger()
 
     def stop_trigger(self):
-        """"Checks if any stop order needs to be triggered"""
-        while True:
-            if self.find_prev_trade():
+        """Activates every stop order crossed by the last trade and executes them in order number order.
+        Called once after every limit and market order, so stops triggered by any of its trades are picked up."""
+        if self.stop_pending is not None:
+            # Already inside a cascade -- the outer call picks up the stops crossed by the new trades
+            return None
+        self.stop_pending = pending = []
+        checked_trade = None
+        try:
+            while True:
                 previous_trade = self.find_prev_trade()
-            else:
-                return None
-            # Check if both stop queues have relevant orders
-            trade_executed = self.stop_both_checker(previous_trade)
-            logging.info(trade_executed)
-            if trade_executed == 0:
-                # Check if both stop queues are empty
-                if self.buy_stop_queue.num_orders == 0 and self.sell_stop_queue.num_orders == 0:
+                if previous_trade is None:
                     return None
-                elif self.buy_stop_queue.num_orders > 0:
-                    if self.buy_stop_queue.extreme_price() <= previous_trade.price:
-                        [_price, stop_number, stop_volume] = self.stop_finder('buy')
-                        stop_order = Order(stop_number, ['Market', 'BUY', stop_volume, 0.0])
-                        self.market_order_processor(stop_order)
-                    else:
-                        return None
-                elif self.sell_stop_queue.num_orders > 0:
-                    if self.sell_stop_queue.extreme_price() >= previous_trade.price:
-                        [_price, stop_number, stop_volume] = self.stop_finder('sell')
-                        stop_order = Order(stop_number, ['Market', 'SELL', stop_volume, 0.0])
-                        self.market_order_processor(stop_order)
-                    else:
-                        return None
-                else:
+                if previous_trade is not checked_trade:
+                    # Only the price levels crossed by the new last trade are visited
+                    for [_price, stop_number, stop_volume] in self.buy_stop_queue.pop_triggered(previous_trade.price):
+                        heappush(pending, (stop_number, 'BUY', stop_volume))
+                    for [_price, stop_number, stop_volume] in self.sell_stop_queue.pop_triggered(previous_trade.price):
+                        heappush(pending, (stop_number, 'SELL', stop_volume))
+                    checked_trade = previous_trade
+                if not pending:
                     return None
-            else:
-                continue
-
-    def stop_both_checker(self, prev_trade):
-        """Used to handle situations where there are stop orders in both queues"""
-        # Check if any stop will need to be triggered
-        trade_executed = 1
-        # Exit if either queue is empty
-        if self.buy_stop_queue.num_orders == 0 or self.sell_stop_queue.num_orders == 0:
-            trade_executed = 0
-            return trade_executed
-        # Exit if conditions are not correct
-        elif self.buy_stop_queue.extreme_price() > prev_trade.price > self.sell_stop_queue.extreme_price():
-            trade_executed = 0
-            return trade_executed
-        elif self.buy_stop_queue.extreme_price() == self.sell_stop_queue.extreme_price():
-            # Need to compare order numbers
-            [buy_price, buy_number, buy_volume] = self.stop_finder('BUY')
-            [sell_price, sell_number, sell_volume] = self.stop_finder('SELL')
-            if buy_number < sell_number:
-                # Execute the buy stop trade
-                stop_order = Order(buy_number, ['Market', 'BUY', buy_volume, 0.0])
-                self.sell_stop_queue.add_order(sell_price, sell_number, sell_volume)
-                self.market_order_processor(stop_order)
-            else:
-                # Execute the sell stop trade
-                stop_order = Order(sell_number, ['Market', 'SELL', sell_volume, 0.0])
-                self.buy_stop_queue.add_order(buy_price, buy_number, buy_volume)
-                self.market_order_processor(stop_order)
-        elif prev_trade.price >= self.buy_stop_queue.extreme_price():
-            [_stop_price, stop_number, stop_volume] = self.stop_finder('BUY')
-            stop_order = Order(stop_number, ['Market', 'BUY', stop_volume, 0.0])
-            self.market_order_processor(stop_order)
-        elif prev_trade.price <= self.sell_stop_queue.extreme_price():
-            [_stop_price, stop_number, stop_volume] = self.stop_finder('SELL')
-            stop_order = Order(stop_number, ['Market', 'SELL', stop_volume, 0.0])
-            self.market_order_processor(stop_order)
-        else:
-            logging.warning('  Unintended stop order details!!!')
-        return trade_executed
-
-    def stop_finder(self, side):
-        """Loop through triggered stop orders and find the earliest"""
-        prev_trade = self.find_prev_trade()
-        stop_dict = {}
-        loop_num = 1
-        if side.upper() == 'BUY':
-            q = self.buy_stop_queue
-            price1 = q.extreme_price()
-            price2 = prev_trade.price
-        else:
-            q = self.sell_stop_queue
-            price1 = prev_trade.price
-            price2 = q.extreme_price()
-        max_iter = q.num_orders
-        while price1 <= price2:
-            [stop_price, stop_number, stop_volume] = q.pop_order()
-            stop_dict[stop_number] = [stop_price, stop_number, stop_volume]
-            if loop_num >= max_iter:
-                break
-            else:
-                loop_num += 1
-        [stop_price, stop_number, stop_volume] = stop_dict.pop(min(stop_dict))
-        for key in stop_dict:
-            q.add_order(stop_dict[key][0], key, stop_dict[key][2])
-        return [stop_price, stop_number, stop_volume]
+                stop_number, side, stop_volume = heappop(pending)
+                self.execute_stop(side, stop_number, stop_volume)
+        finally:
+            self.stop_pending = None
+
+    def execute_stop(self, side, stop_number, stop_volume):
+        """Send a triggered stop order through as a market order"""
+        self.sink.on_stop_trigger(side, stop_number, stop_volume)
+        self.market_order_processor(Order(stop_number, ['Market', side, stop_volume, 0.0]))
 
     def find_prev_trade(self):
-        if not self.trade_book.trade_list:
-            return None
-        prev_trade = self.trade_book.trade_list[-1]
-        return prev_trade
+        return self.trade_book.last_trade()
 
 
 class Order:
+    __slots__ = ('position', 'type', 'side', 'type_code', 'side_code', 'order_to_cancel', 'order_to_amend', 'volume',
+                 'volume_to_trade', 'price')
+
     def __init__(self, pos, in_list):
         self.position = pos
         self.type = in_list[0]
         self.side = in_list[1]
-        if self.type.upper() == 'CANCEL':
+        # None for an unknown type, which order_sorter rejects, and for the 'na' side of cancels and amends
+        self.type_code = TYPE_CODES.get(self.type.upper())
+        self.side_code = SIDE_CODES.get(self.side.upper())
+        if self.type_code == CANCEL:
             self.order_to_cancel = in_list[2]
+        elif self.type_code == AMEND:
+            # ['Amend', side, order to amend, new volume, new price]
+            self.order_to_amend = in_list[2]
+            self.volume = in_list[3]
+            self.volume_to_trade = in_list[3]
         else:
             self.volume = in_list[2]
             self.volume_to_trade = in_list[2]
-        self.price = in_list[3]
+        self.price = in_list[-1]
 
 
 class OrderQueue:
-    def __init__(self, name, order_type):
+    def __init__(self, name, order_type, compact_ratio=0.5, compact_min=1024):
+        """Heap of resting orders.  Removed orders stay behind as tombstones until they reach the top of the heap, or
+        until more than compact_min of them make up over compact_ratio of the heap and it is rebuilt without them."""
         self.name = name
         self.pq = []
         self.order_dict = {}
+        # Shared with the other queues of an OrderBook
+        self.order_index = {}
         self.num_orders = 0
-        self.REMOVED = '<removed-order_id>'
+        self.sink = NULL_SINK
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.num_tombstones = 0
+        self.num_reclaimed = 0
         if order_type.upper() == 'SELL':
             self.sell_negator = 1
         else:
@@ -277,66 +295,357 @@ class OrderQueue:
 
     def add_order(self, order_price, order_id, order_volume):
         """Add a new order_id or update the order_price of an existing order_id"""
-        logging.info(
-            '  ADDING {} shares at ${} with #{} into {}'.format(order_volume, order_price, order_id,
-                                                                self.name))
+        self.sink.on_add(self, order_price, order_id, order_volume)
         order_price = self.sell_negator * order_price
         if order_id in self.order_dict:
             self.remove_order(order_id)
         entry = [order_price, order_id, order_volume]
         self.order_dict[order_id] = entry
+        self.order_index[order_id] = self
         heappush(self.pq, entry)
         self.num_orders += 1
 
     def remove_order(self, order_id):
-        """Mark an existing order_id as REMOVED.  Raise KeyError if not found."""
+        """Remove an existing order_id, leaving its heap entry behind as a tombstone.  Raise KeyError if not found."""
         entry = self.order_dict.pop(order_id)
-        entry[-2] = self.REMOVED
+        del self.order_index[order_id]
         self.num_orders -= 1
-        # Check if removed order is next to pop
-        if self.pq[0][1] == self.REMOVED:
-            heappop(self.pq)
+        self.num_tombstones += 1
+        self.sink.on_cancel(self, entry[0] * self.sell_negator, order_id, entry[2])
+        if self.num_tombstones > max(self.compact_min, self.compact_ratio * len(self.pq)):
+            self.compact()
+        else:
+            # Check if removed order is next to pop
+            self.discard_removed()
+
+    def get_order(self, order_id):
+        """Return an existing order_id as [price, order_id, volume].  Raise KeyError if not found."""
+        entry = self.order_dict[order_id]
+        return [entry[0] * self.sell_negator, order_id, entry[2]]
+
+    def reduce_order(self, order_id, order_volume):
+        """Lower the volume of an existing order_id in place, keeping its priority.  Raise KeyError if not found."""
+        entry = self.order_dict[order_id]
+        if order_volume < entry[2]:
+            self.sink.on_amend(self, entry[0] * self.sell_negator, order_id, entry[2] - order_volume)
+            entry[2] = order_volume
+
+    def remove_all(self):
+        """Remove every order, returning how many were removed"""
+        num_removed = self.num_orders
+        for order_id, entry in self.order_dict.items():
+            del self.order_index[order_id]
+            self.sink.on_cancel(self, entry[0] * self.sell_negator, order_id, entry[2])
+        self.order_dict.clear()
+        self.pq = []
+        self.num_orders = 0
+        self.num_reclaimed += self.num_tombstones
+        self.num_tombstones = 0
+        return num_removed
+
+    def remove_price_range(self, low_price, high_price):
+        """Remove every order priced between low_price and high_price inclusive and rebuild the heap without them"""
+        keys = sorted([self.sell_negator * low_price, self.sell_negator * high_price])
+        removed = [entry for entry in self.order_dict.values() if keys[0] <= entry[0] <= keys[1]]
+        for entry in removed:
+            del self.order_dict[entry[1]]
+            del self.order_index[entry[1]]
+            self.sink.on_cancel(self, entry[0] * self.sell_negator, entry[1], entry[2])
+        if removed:
+            self.num_orders -= len(removed)
+            self.compact()
+        return len(removed)
+
+    def compact(self):
+        """Rebuild the heap from the live orders, returning how many tombstones were reclaimed"""
+        self.pq = list(self.order_dict.values())
+        heapify(self.pq)
+        num_reclaimed = self.num_tombstones
+        self.num_reclaimed += num_reclaimed
+        self.num_tombstones = 0
+        return num_reclaimed
 
     def pop_order(self):
         """Pop sorted by order_price then order_id. Raise KeyError if empty."""
         while self.pq:
-            order_price, order_id, order_volume = heappop(self.pq)
-            if order_id is not self.REMOVED:
+            entry = heappop(self.pq)
+            order_price, order_id, order_volume = entry
+            if self.order_dict.get(order_id) is entry:
                 del self.order_dict[order_id]
+                del self.order_index[order_id]
                 self.num_orders -= 1
-                logging.info('  REMOVING {} shares at ${} with #{} from {}'.format(order_volume,
-                                                                                   order_price * self.sell_negator,
-                                                                                   order_id, self.name))
-                return [order_price * self.sell_negator, order_id, order_volume]
+                order_price = order_price * self.sell_negator
+                self.sink.on_remove(self, order_price, order_id, order_volume)
+                return [order_price, order_id, order_volume]
+            self.num_tombstones -= 1
+            self.num_reclaimed += 1
         raise ValueError('Queue is empty!')
 
     def extreme_price(self):
         """Return the relevant extreme price -- Highest bid or lowest ask"""
-        while self.pq[0][1] == self.REMOVED:
-            heappop(self.pq)
+        self.discard_removed()
         order = self.pq[0]
         return order[0] * self.sell_negator
 
     def extreme_volume(self):
         """Return the relevant extreme volume -- Highest bid or lowest ask"""
-        while self.pq[0][1] == self.REMOVED:
-            heappop(self.pq)
+        self.discard_removed()
         order = self.pq[0]
         return order[2]
 
+    def discard_removed(self):
+        """Pop tombstones off the top of the heap -- an entry is live only while order_dict still points at it"""
+        pq = self.pq
+        while pq and self.order_dict.get(pq[0][1]) is not pq[0]:
+            heappop(pq)
+            self.num_tombstones -= 1
+            self.num_reclaimed += 1
 
-class StopOrderQueue(OrderQueue):
-    def __init__(self, name, order_type):
-        """Define subclass of OrderQueue to handle priority queue properly"""
-        OrderQueue.__init__(self, name, order_type)
+    def num_entries(self):
+        """Return the size of the heap, counting tombstones"""
+        return len(self.pq)
+
+    def entries(self):
+        """Return every live order as [price, order_id, volume] -- tombstones are skipped"""
+        neg = self.sell_negator
+        return [[entry[0] * neg, entry[1], entry[2]] for entry in self.order_dict.values()]
+
+    def load_orders(self, orders):
+        """Bulk load (price, order_id, volume) orders and heapify once instead of pushing each order"""
+        neg = self.sell_negator
+        entries = [[neg * order_price, order_id, order_volume] for order_price, order_id, order_volume in orders]
+        order_ids = [entry[1] for entry in entries]
+        self.order_dict.update(zip(order_ids, entries))
+        self.order_index.update(dict.fromkeys(order_ids, self))
+        self.num_orders = len(self.order_dict)
+        self.compact()
+
+    def take_order(self, max_volume):
+        """Trade up to max_volume shares of the extreme order, popping it and adding back any leftover shares"""
+        order_price, order_id, order_volume = self.pop_order()
+        if order_volume > max_volume:
+            self.add_order(order_price, order_id, order_volume - max_volume)
+            return [order_price, order_id, max_volume]
+        return [order_price, order_id, order_volume]
+
+
+class PriceLevel:
+    def __init__(self, price):
+        """FIFO queue of the orders resting at a single price"""
+        self.price = price
+        self.orders = deque()
+        self.num_orders = 0
+        self.volume = 0
+
+
+class PriceLevelQueue:
+    def __init__(self, name, order_type, compact_ratio=0.5, compact_min=1024):
+        """Alternative to OrderQueue that groups orders into FIFO price levels.  Removed orders are marked REMOVED in
+        their level and compacted away on the same compact_ratio and compact_min terms as OrderQueue."""
         self.name = name
+        self.levels = {}
+        # Level keys kept sorted so that the extreme level is always last
+        self.prices = []
+        self.order_dict = {}
+        # Shared with the other queues of an OrderBook
+        self.order_index = {}
+        self.num_orders = 0
+        self.sink = NULL_SINK
+        self.REMOVED = '<removed-order_id>'
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.num_tombstones = 0
+        self.num_reclaimed = 0
         if order_type.upper() == 'SELL':
+            self.sell_negator = 1
+        else:
             self.sell_negator = -1
+
+    def add_order(self, order_price, order_id, order_volume):
+        """Add a new order_id to the back of its price level or update an existing order_id"""
+        self.sink.on_add(self, order_price, order_id, order_volume)
+        if order_id in self.order_dict:
+            self.remove_order(order_id)
+        key = -self.sell_negator * order_price
+        level = self.levels.get(key)
+        if level is None:
+            level = self.levels[key] = PriceLevel(order_price)
+            insort(self.prices, key)
+        entry = [order_price, order_id, order_volume]
+        level.orders.append(entry)
+        level.num_orders += 1
+        level.volume += order_volume
+        self.order_dict[order_id] = entry
+        self.order_index[order_id] = self
+        self.num_orders += 1
+
+    def remove_order(self, order_id):
+        """Mark an existing order_id as REMOVED.  Raise KeyError if not found."""
+        entry = self.order_dict.pop(order_id)
+        del self.order_index[order_id]
+        key = -self.sell_negator * entry[0]
+        level = self.levels[key]
+        self.sink.on_cancel(self, entry[0], order_id, entry[2])
+        entry[1] = self.REMOVED
+        level.num_orders -= 1
+        level.volume -= entry[2]
+        self.num_orders -= 1
+        self.num_tombstones += 1
+        if level.num_orders == 0:
+            del self.levels[key]
+            del self.prices[bisect_left(self.prices, key)]
+            self._reclaim(len(level.orders))
+        elif self.num_tombstones > max(self.compact_min, self.compact_ratio * self.num_entries()):
+            self.compact()
         else:
-            self.sell_negator = 1
+            self._discard_removed(level)
+
+    def get_order(self, order_id):
+        """Return an existing order_id as [price, order_id, volume].  Raise KeyError if not found."""
+        return list(self.order_dict[order_id])
+
+    def reduce_order(self, order_id, order_volume):
+        """Lower the volume of an existing order_id in place, keeping its place in its level.  Raise KeyError if not
+        found."""
+        entry = self.order_dict[order_id]
+        if order_volume < entry[2]:
+            self.sink.on_amend(self, entry[0], order_id, entry[2] - order_volume)
+            self.levels[-self.sell_negator * entry[0]].volume -= entry[2] - order_volume
+            entry[2] = order_volume
+
+    def pop_order(self):
+        """Pop the first order of the extreme price level. Raise ValueError if empty."""
+        if not self.prices:
+            raise ValueError('Queue is empty!')
+        level = self.levels[self.prices[-1]]
+        entry = level.orders.popleft()
+        order_price, order_id, order_volume = entry
+        del self.order_dict[order_id]
+        del self.order_index[order_id]
+        level.num_orders -= 1
+        level.volume -= order_volume
+        self.num_orders -= 1
+        if level.num_orders == 0:
+            del self.levels[self.prices.pop()]
+            self._reclaim(len(level.orders))
+        else:
+            self._discard_removed(level)
+        self.sink.on_remove(self, order_price, order_id, order_volume)
+        return entry
+
+    def remove_all(self):
+        """Remove every order, returning how many were removed"""
+        return len(self.cut_levels(0, len(self.prices), self.sink.on_cancel))
+
+    def remove_price_range(self, low_price, high_price):
+        """Remove whole price levels between low_price and high_price inclusive, returning how many orders were removed"""
+        keys = sorted([-self.sell_negator * low_price, -self.sell_negator * high_price])
+        i = bisect_left(self.prices, keys[0])
+        j = bisect_right(self.prices, keys[1])
+        return len(self.cut_levels(i, j, self.sink.on_cancel))
+
+    def num_entries(self):
+        """Return how many entries the price levels hold, counting REMOVED orders"""
+        return self.num_orders + self.num_tombstones
+
+    def compact(self):
+        """Drop the REMOVED orders from every price level, returning how many were reclaimed"""
+        for level in self.levels.values():
+            if len(level.orders) != level.num_orders:
+                level.orders = deque(entry for entry in level.orders if entry[1] is not self.REMOVED)
+        num_reclaimed = self.num_tombstones
+        self._reclaim(num_reclaimed)
+        return num_reclaimed
+
+    def entries(self):
+        """Return every live order as [price, order_id, volume], oldest first within each price level"""
+        return list(self.order_dict.values())
+
+    def load_orders(self, orders):
+        """Bulk load (price, order_id, volume) orders, oldest first within each price level, sorting the index once"""
+        neg = self.sell_negator
+        levels = self.levels
+        order_dict = self.order_dict
+        order_index = self.order_index
+        for order_price, order_id, order_volume in orders:
+            key = -neg * order_price
+            level = levels.get(key)
+            if level is None:
+                level = levels[key] = PriceLevel(order_price)
+            entry = [order_price, order_id, order_volume]
+            level.orders.append(entry)
+            level.num_orders += 1
+            level.volume += order_volume
+            order_dict[order_id] = entry
+            order_index[order_id] = self
+        self.prices = sorted(levels)
+        self.num_orders = len(order_dict)
+
+    def cut_levels(self, i, j, event):
+        """Drop the levels between positions i and j of prices, reporting every live order to event and returning them"""
+        removed = []
+        for key in self.prices[i:j]:
+            level = self.levels.pop(key)
+            for entry in level.orders:
+                if entry[1] is not self.REMOVED:
+                    del self.order_dict[entry[1]]
+                    del self.order_index[entry[1]]
+                    event(self, entry[0], entry[1], entry[2])
+                    removed.append(entry)
+            self.num_orders -= level.num_orders
+            self._reclaim(len(level.orders) - level.num_orders)
+        del self.prices[i:j]
+        return removed
+
+    def extreme_price(self):
+        """Return the relevant extreme price -- Highest bid or lowest ask"""
+        return self.levels[self.prices[-1]].price
+
+    def extreme_volume(self):
+        """Return the relevant extreme volume -- Highest bid or lowest ask"""
+        return self.levels[self.prices[-1]].orders[0][2]
+
+    def take_order(self, max_volume):
+        """Trade up to max_volume shares of the extreme order, reducing it in place on a partial fill"""
+        level = self.levels[self.prices[-1]]
+        entry = level.orders[0]
+        if entry[2] > max_volume:
+            entry[2] -= max_volume
+            level.volume -= max_volume
+            self.sink.on_reduce(self, entry[0], entry[1], max_volume)
+            return [entry[0], entry[1], max_volume]
+        return self.pop_order()
+
+    def _discard_removed(self, level):
+        """Drop REMOVED orders from the front of a level so its first order is always live"""
+        orders = level.orders
+        while orders[0][1] is self.REMOVED:
+            orders.popleft()
+            self._reclaim(1)
+
+    def _reclaim(self, num_reclaimed):
+        self.num_tombstones -= num_reclaimed
+        self.num_reclaimed += num_reclaimed
+
+
+class StopOrderQueue(PriceLevelQueue):
+    def __init__(self, name, order_type):
+        """Stop orders indexed by trigger price -- the extreme level is the next one a trade can cross"""
+        # Buy stops trigger from the lowest price up, sell stops from the highest price down
+        if order_type.upper() == 'SELL':
+            PriceLevelQueue.__init__(self, name, 'buy')
+        else:
+            PriceLevelQueue.__init__(self, name, 'sell')
+
+    def pop_triggered(self, last_price):
+        """Pop every stop order whose trigger price has been crossed by last_price"""
+        i = bisect_left(self.prices, -self.sell_negator * last_price)
+        return self.cut_levels(i, len(self.prices), self.sink.on_remove)
 
 
 class Trade:
+    __slots__ = ('shares', 'price', 'order_in_num', 'order_q_num')
+
     def __init__(self, trade_price, trade_vol, order_in_num, order_q_num):
         self.shares = trade_vol
         self.price = trade_price
@@ -347,9 +656,23 @@ class Trade:
 class TradeBook:
     def __init__(self):
         self.trade_list = []
+        # Stands in for the previous trade before any trade has been made
+        self.reference_trade = None
+        self.sink = NULL_SINK
 
     def create_trade(self, trade_price, trade_vol, order_in_num, order_q_num):
         """Creates a trade object and adds it to the trade list"""
-        trade = Trade(trade_price, trade_vol, order_in_num, order_q_num)
-        self.trade_list.append(trade)
-        logging.error('match %d %d %d %.2f' % (trade.order_in_num, trade.order_q_num, trade.shares, trade.price))
+        self.trade_list.append(Trade(trade_price, trade_vol, order_in_num, order_q_num))
+        self.sink.on_trade(trade_price, trade_vol, order_in_num, order_q_num)
+
+    def last_trade(self):
+        """Returns the most recent trade"""
+        if not self.trade_list:
+            return self.reference_trade
+        return self.trade_list[-1]
+
+    def __len__(self):
+        return len(self.trade_list)
+
+    def __getitem__(self, i):
+        return self.trade_list[i]
@@ -0,0 +1,98 @@
+from orderbook import OrderBook, Order, OrderQueue, PriceLevelQueue, to_ticks
+from itertools import islice
+import argparse
+import logging
+import mmap
+import time
+
+BACKENDS = {'heap': OrderQueue, 'level': PriceLevelQueue}
+
+
+def order_fields(fields, tick_size=None):
+    """Convert the split fields of an order line to Order fields -- an amend line carries its new volume before the
+    price, as in 'amend na <order number> <volume> <price>'.  With tick_size the price is converted to integer ticks."""
+    price = float(fields[-1])
+    if tick_size is not None:
+        price = to_ticks(price, tick_size)
+    if fields[0].upper() == 'AMEND':
+        return [fields[0], fields[1], int(fields[2]), int(fields[3]), price]
+    return [fields[0], fields[1], int(fields[2]), price]
+
+
+def parse_order(position, line, tick_size=None):
+    """Turn one line of an order file into an Order -- returns None for blank lines"""
+    fields = line.split()
+    if not fields:
+        return None
+    return Order(position, order_fields(fields, tick_size))
+
+
+def read_lines(path, use_mmap=False, chunk_size=1 << 20):
+    """Lazily yield the lines of an order file, reading chunk_size bytes at a time or through a memory map"""
+    if use_mmap:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''):
+                yield line.decode('ascii')
+    else:
+        with open(path, buffering=chunk_size) as f:
+            yield from f
+
+
+def iter_orders(path, use_mmap=False, chunk_size=1 << 20, tick_size=None):
+    """Lazily parse an order file, numbering orders from 1 in file order"""
+    position = 0
+    for line in read_lines(path, use_mmap, chunk_size):
+        order = parse_order(position + 1, line, tick_size)
+        if order is not None:
+            position += 1
+            yield order
+
+
+def iter_batches(orders, batch_size):
+    """Group an order iterator into lists of at most batch_size orders"""
+    orders = iter(orders)
+    while True:
+        batch = list(islice(orders, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def ingest(path, book=None, batch_size=None, use_mmap=False, chunk_size=1 << 20):
+    """Stream an order file into book, returning the book, number of orders and elapsed seconds.
+    Prices are parsed as integer ticks when the book has a tick_size."""
+    if book is None:
+        book = OrderBook()
+    orders = iter_orders(path, use_mmap, chunk_size, book.tick_size)
+    num_orders = 0
+    start = time.perf_counter()
+    if batch_size:
+        for batch in iter_batches(orders, batch_size):
+            for order in batch:
+                book.order_sorter(order)
+            num_orders += len(batch)
+    else:
+        for order in orders:
+            book.order_sorter(order)
+            num_orders += 1
+    return book, num_orders, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream an order file through the order book')
+    parser.add_argument('path', help='order file in the stock_orders.txt format')
+    parser.add_argument('--batch-size', type=int, default=None, help='parse orders in batches of this size')
+    parser.add_argument('--mmap', action='store_true', help='read the file through a memory map')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='heap', help='limit book backend')
+    parser.add_argument('--tick-size', type=float, default=None, help='match on integer ticks of this size')
+    parser.add_argument('--log-level', default='ERROR', help='logging level, ERROR prints every match')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.log_level.upper())
+    book = OrderBook(BACKENDS[args.backend], tick_size=args.tick_size)
+    _book, num_orders, elapsed = ingest(args.path, book, args.batch_size, args.mmap)
+    rate = num_orders / elapsed if elapsed else float('inf')
+    print('{} orders in {:.3f}s ({:,.0f} orders/sec)'.format(num_orders, elapsed, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+from array import array
+from auction import CallAuction
+from eventsink import EventSink, TeeSink
+from orderbook import CANCEL, AMEND, TYPE_CODES, Order, Trade
+import gc
+import logging
+import os
+import struct
+
+ORDER_RECORD = struct.Struct('<BqBBqd')
+TRADE_RECORD = struct.Struct('<Bdqqq')
+AMEND_RECORD = struct.Struct('<Bqqqd')
+AUCTION_RECORD = struct.Struct('<BB')
+CANCEL_RECORD = struct.Struct('<Bq')
+ORDER_KIND, TRADE_KIND, AMEND_KIND, AUCTION_KIND, CANCEL_KIND = 1, 2, 3, 4, 5
+# Records use the order type and side codes of orderbook, with 2 for the 'na' side
+TYPE_NAMES = {code: name.capitalize() for name, code in TYPE_CODES.items()}
+SIDE_NAMES = {0: 'BUY', 1: 'SELL', 2: 'na'}
+
+# Journal records keep prices as doubles, which hold integer tick prices exactly; snapshots of a book with a tick_size
+# store them as integers and say so in the header
+SNAPSHOT_MAGIC = b'OBSNAP02'
+SNAPSHOT_HEADER = struct.Struct('<8sqBdB')
+QUEUE_NAMES = ('buy_queue', 'sell_queue', 'buy_stop_queue', 'sell_stop_queue')
+
+
+class Journal(EventSink):
+    def __init__(self, path, snapshot_path=None, snapshot_every=None, sync=False, flush_every=1):
+        """Append-only binary journal of the orders accepted by an OrderBook, the trades they produced, orders removed
+        by the mass-cancel calls of the book and the start and uncross of every call auction.
+
+        An order and its trades are written once order_sorter has finished with it.  The journal is flushed after
+        every flush_every orders or other records, and sync fsyncs it on every flush.  With snapshot_path and
+        snapshot_every, a snapshot of the book is written before every snapshot_every-th order so a restart only
+        replays the journal tail."""
+        EventSink.__init__(self)
+        self.path = path
+        self.f = open(path, 'ab')
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.sync = sync
+        self.flush_every = flush_every
+        self.num_unflushed = 0
+        self.book = None
+        self.orders_since_snapshot = 0
+        # Records of the order being processed, written once order_sorter has accepted it
+        self.pending = None
+
+    def attach(self, book):
+        """Start journalling book, keeping its current sink"""
+        self.book = book
+        book.set_sink(TeeSink(book.sink, self))
+
+    def on_order(self, order_in):
+        # The records of the previous order are written and this order's are not, so a snapshot taken here matches
+        # the end of the journal
+        if self.snapshot_every is not None:
+            # A snapshot only holds the queues, so none is taken while an auction is collecting orders
+            if self.orders_since_snapshot >= self.snapshot_every and self.book.auction is None:
+                self.snapshot()
+            self.orders_since_snapshot += 1
+        # A rejected order raises out of order_sorter before on_order_done, so its records are dropped here
+        self.pending = pending = []
+        type_code = order_in.type_code
+        if type_code is None:
+            # order_sorter rejects unknown order types
+            return None
+        if type_code == AMEND:
+            pending.append(AMEND_RECORD.pack(AMEND_KIND, order_in.position, order_in.order_to_amend, order_in.volume,
+                                             order_in.price))
+            return None
+        if type_code == CANCEL:
+            volume = order_in.order_to_cancel
+        else:
+            volume = order_in.volume
+        side_code = 2 if order_in.side_code is None else order_in.side_code
+        pending.append(ORDER_RECORD.pack(ORDER_KIND, order_in.position, type_code, side_code, volume, order_in.price))
+
+    def on_order_done(self, order_in):
+        if self.pending is not None:
+            self.f.write(b''.join(self.pending))
+            self.pending = None
+            self.written()
+
+    def on_trade(self, price, shares, order_in_num, order_q_num):
+        record = TRADE_RECORD.pack(TRADE_KIND, price, shares, order_in_num, order_q_num)
+        if self.pending is None:
+            self.f.write(record)
+            self.written()
+        else:
+            self.pending.append(record)
+
+    def on_cancel(self, queue, price, order_id, volume):
+        # Cancels made by an order are replayed with the order.  The others come from the mass-cancel calls of the
+        # book, apart from the resting limit orders an auction pulls in as it starts, which restore pulls in again.
+        if self.pending is not None:
+            return None
+        book = self.book
+        if book.auction is not None and (queue is book.buy_queue or queue is book.sell_queue):
+            return None
+        self.f.write(CANCEL_RECORD.pack(CANCEL_KIND, order_id))
+        self.written()
+
+    def on_auction(self, running):
+        self.f.write(AUCTION_RECORD.pack(AUCTION_KIND, running))
+        self.written()
+
+    def written(self):
+        """Count a complete order or record, flushing after every flush_every of them"""
+        self.num_unflushed += 1
+        if self.num_unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Flush buffered records and return the journal offset they end at"""
+        self.num_unflushed = 0
+        self.f.flush()
+        if self.sync:
+            os.fsync(self.f.fileno())
+        return self.f.tell()
+
+    def snapshot(self):
+        """Snapshot the attached book at the current end of the journal"""
+        write_snapshot(self.book, self.snapshot_path, self.flush())
+        self.orders_since_snapshot = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def read_journal(path, offset=0, integer_prices=False):
+    """Yield ('order', Order) and ('trade', (price, shares, order_in_num, order_q_num)) records from offset on.
+    Amends are yielded as ('order', Order) too, orders removed by a mass cancel as ('cancel', order number) and the
+    start and uncross of an auction as ('auction', running).
+    integer_prices gives prices back as integer ticks, for a book with a tick_size."""
+    to_price = int if integer_prices else float
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    pos = 0
+    end = len(data)
+    while pos < end:
+        kind = data[pos]
+        if kind == ORDER_KIND:
+            if pos + ORDER_RECORD.size > end:
+                return
+            _kind, position, type_code, side_code, volume, price = ORDER_RECORD.unpack_from(data, pos)
+            pos += ORDER_RECORD.size
+            # Unknown codes give an Order that order_sorter rejects
+            yield 'order', Order(position, [TYPE_NAMES.get(type_code, str(type_code)),
+                                            SIDE_NAMES.get(side_code, str(side_code)), volume, to_price(price)])
+        elif kind == TRADE_KIND:
+            if pos + TRADE_RECORD.size > end:
+                return
+            _kind, price, shares, order_in_num, order_q_num = TRADE_RECORD.unpack_from(data, pos)
+            yield 'trade', (to_price(price), shares, order_in_num, order_q_num)
+            pos += TRADE_RECORD.size
+        elif kind == AMEND_KIND:
+            if pos + AMEND_RECORD.size > end:
+                return
+            _kind, position, order_to_amend, volume, price = AMEND_RECORD.unpack_from(data, pos)
+            pos += AMEND_RECORD.size
+            yield 'order', Order(position, ['Amend', 'na', order_to_amend, volume, to_price(price)])
+        elif kind == AUCTION_KIND:
+            if pos + AUCTION_RECORD.size > end:
+                return
+            yield 'auction', bool(AUCTION_RECORD.unpack_from(data, pos)[1])
+            pos += AUCTION_RECORD.size
+        elif kind == CANCEL_KIND:
+            if pos + CANCEL_RECORD.size > end:
+                return
+            yield 'cancel', CANCEL_RECORD.unpack_from(data, pos)[1]
+            pos += CANCEL_RECORD.size
+        else:
+            raise ValueError('Corrupt journal record at offset {}'.format(offset + pos))
+
+
+def write_snapshot(book, path, journal_offset=0):
+    """Write the live orders of all four queues and the last trade price to path, replacing it atomically"""
+    prev_trade = book.find_prev_trade()
+    integer_prices = book.tick_size is not None
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, journal_offset, prev_trade is not None,
+                                     prev_trade.price if prev_trade is not None else 0.0, integer_prices))
+        for name in QUEUE_NAMES:
+            entries = getattr(book, name).entries()
+            f.write(struct.pack('<q', len(entries)))
+            array('q' if integer_prices else 'd', [entry[0] for entry in entries]).tofile(f)
+            array('q', [entry[1] for entry in entries]).tofile(f)
+            array('q', [entry[2] for entry in entries]).tofile(f)
+    os.replace(tmp_path, path)
+
+
+def load_snapshot(book, path):
+    """Load a snapshot into an empty book, returning the journal offset it was taken at.
+    Raises ValueError if the snapshot was taken of a book priced differently -- in ticks or not."""
+    # Building millions of order entries would otherwise set off repeated full garbage collections
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as f:
+            header = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+            magic, journal_offset, has_prev_trade, prev_price, integer_prices = header
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError('{} is not an order book snapshot'.format(path))
+            if integer_prices != (book.tick_size is not None):
+                raise ValueError('{} does not match the tick_size of the book'.format(path))
+            for name in QUEUE_NAMES:
+                [count] = struct.unpack('<q', f.read(8))
+                prices, ids, volumes = array('q' if integer_prices else 'd'), array('q'), array('q')
+                prices.fromfile(f, count)
+                ids.fromfile(f, count)
+                volumes.fromfile(f, count)
+                getattr(book, name).load_orders(zip(prices.tolist(), ids.tolist(), volumes.tolist()))
+    finally:
+        if gc_enabled:
+            gc.enable()
+    if has_prev_trade:
+        book.trade_book.reference_trade = Trade(int(prev_price) if integer_prices else prev_price, 0, 0, 0)
+    return journal_offset
+
+
+def restore(book, snapshot_path, journal_path):
+    """Rebuild book from the latest snapshot plus the journal tail written after it.  Orders the book rejects are
+    logged and skipped, and journalled auctions are run again -- if the journal ends during an auction, book.auction is
+    left collecting.  Returns the number of orders replayed -- attach a Journal to the book only after restoring."""
+    offset = 0
+    if os.path.exists(snapshot_path):
+        offset = load_snapshot(book, snapshot_path)
+    num_replayed = 0
+    if os.path.exists(journal_path):
+        for kind, record in read_journal(journal_path, offset, book.tick_size is not None):
+            if kind == 'order':
+                try:
+                    book.order_sorter(record)
+                except ValueError as e:
+                    logging.warning(' ORDER %s REJECTED ON REPLAY: %s', record.position, e)
+                    continue
+                num_replayed += 1
+            elif kind == 'cancel':
+                book.cancel_orders((record,))
+            elif kind == 'auction':
+                if record:
+                    CallAuction(book).start()
+                elif book.auction is not None:
+                    book.auction.uncross()
+    return num_replayed
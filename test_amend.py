@@ -0,0 +1,104 @@
+from eventsink import NullSink
+from orderbook import OrderBook, OrderQueue, PriceLevelQueue, Order
+from persistence import Journal, read_journal, restore
+import pytest
+
+BACKENDS = [OrderQueue, PriceLevelQueue]
+
+
+def make_book(queue_class, orders):
+    book = OrderBook(queue_class, NullSink())
+    for order in orders:
+        book.order_sorter(order)
+    return book
+
+
+def trades(book):
+    return [(t.price, t.shares, t.order_in_num, t.order_q_num) for t in book.trade_book.trade_list]
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+def test_decrease_keeps_priority(queue_class):
+    book = make_book(queue_class, [Order(1, ['Limit', 'BUY', 10, 100.0]), Order(2, ['Limit', 'BUY', 5, 100.0]),
+                                   Order(3, ['Amend', 'na', 1, 4, 100.0]),
+                                   Order(4, ['Market', 'SELL', 6, 0.0])])
+    assert trades(book) == [(100.0, 4, 4, 1), (100.0, 2, 4, 2)]
+    assert sorted(book.buy_queue.entries()) == [[100.0, 2, 3]]
+    assert 3 not in book.order_index
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+def test_reprice_loses_priority_and_takes_amend_number(queue_class):
+    book = make_book(queue_class, [Order(1, ['Limit', 'BUY', 5, 99.0]), Order(2, ['Limit', 'BUY', 5, 100.0]),
+                                   Order(3, ['Amend', 'na', 1, 5, 100.0])])
+    assert 1 not in book.order_index
+    assert sorted(book.buy_queue.entries()) == [[100.0, 2, 5], [100.0, 3, 5]]
+    book.order_sorter(Order(4, ['Market', 'SELL', 7, 0.0]))
+    assert trades(book) == [(100.0, 5, 4, 2), (100.0, 2, 4, 3)]
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+def test_volume_increase_loses_priority(queue_class):
+    book = make_book(queue_class, [Order(1, ['Limit', 'SELL', 5, 101.0]), Order(2, ['Limit', 'SELL', 5, 101.0]),
+                                   Order(3, ['Amend', 'na', 1, 8, 101.0]),
+                                   Order(4, ['Market', 'BUY', 5, 0.0])])
+    assert trades(book) == [(101.0, 5, 4, 2)]
+    assert sorted(book.sell_queue.entries()) == [[101.0, 3, 8]]
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+def test_crossing_reprice_trades(queue_class):
+    book = make_book(queue_class, [Order(1, ['Limit', 'SELL', 5, 101.0]), Order(2, ['Limit', 'SELL', 5, 102.0]),
+                                   Order(3, ['Limit', 'BUY', 8, 100.0]), Order(4, ['Amend', 'na', 3, 8, 101.0])])
+    assert trades(book) == [(101.0, 5, 4, 1)]
+    assert sorted(book.buy_queue.entries()) == [[101.0, 4, 3]]
+    assert sorted(book.sell_queue.entries()) == [[102.0, 2, 5]]
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+def test_amend_stop(queue_class):
+    book = make_book(queue_class, [Order(1, ['Limit', 'SELL', 20, 101.0]), Order(2, ['Stop', 'BUY', 10, 100.0]),
+                                   Order(3, ['Amend', 'na', 2, 6, 100.0])])
+    assert sorted(book.buy_stop_queue.entries()) == [[100.0, 2, 6]]
+    book.order_sorter(Order(4, ['Amend', 'na', 2, 6, 102.0]))
+    assert sorted(book.buy_stop_queue.entries()) == [[102.0, 4, 6]]
+    # A trade at 101 does not reach the amended stop price
+    book.order_sorter(Order(5, ['Market', 'BUY', 1, 0.0]))
+    assert book.buy_stop_queue.num_orders == 1
+    # Amended down to the last trade price, the stop triggers at once and keeps the amend's number
+    book.order_sorter(Order(6, ['Amend', 'na', 4, 6, 101.0]))
+    assert trades(book) == [(101.0, 1, 5, 1), (101.0, 6, 6, 1)]
+    assert book.buy_stop_queue.num_orders == 0
+
+
+@pytest.mark.parametrize('queue_class', BACKENDS)
+@pytest.mark.parametrize('volume', [0, -5])
+def test_non_positive_volume_is_rejected(queue_class, volume):
+    book = make_book(queue_class, [Order(1, ['Limit', 'BUY', 5, 100.0])])
+    with pytest.raises(ValueError):
+        book.order_sorter(Order(2, ['Amend', 'na', 1, volume, 100.0]))
+    assert book.buy_queue.entries() == [[100.0, 1, 5]]
+
+
+def test_amend_of_unknown_order_is_ignored():
+    book = make_book(OrderQueue, [Order(1, ['Limit', 'BUY', 5, 100.0]), Order(2, ['Amend', 'na', 9, 3, 100.0])])
+    assert book.buy_queue.entries() == [[100.0, 1, 5]]
+
+
+def test_journal_round_trip(tmp_path):
+    journal_path = str(tmp_path / 'journal')
+    book = OrderBook(sink=NullSink())
+    journal = Journal(journal_path)
+    journal.attach(book)
+    for order in (Order(1, ['Limit', 'BUY', 5, 100.0]), Order(2, ['Limit', 'BUY', 5, 99.0]),
+                  Order(3, ['Amend', 'na', 1, 3, 100.0]), Order(4, ['Amend', 'na', 2, 4, 101.0]),
+                  Order(5, ['Market', 'SELL', 6, 0.0])):
+        book.order_sorter(order)
+    journal.close()
+    amends = [(order.position, order.order_to_amend, order.volume, order.price)
+              for kind, order in read_journal(journal_path) if kind == 'order' and order.type == 'Amend']
+    assert amends == [(3, 1, 3, 100.0), (4, 2, 4, 101.0)]
+    restored = OrderBook(sink=NullSink())
+    assert restore(restored, str(tmp_path / 'snapshot'), journal_path) == 5
+    assert sorted(restored.buy_queue.entries()) == sorted(book.buy_queue.entries()) == [[100.0, 1, 1]]
+    assert trades(restored) == trades(book)
@@ -0,0 +1,30 @@
+from eventsink import NullSink
+from gateway import OrderGateway
+from orderbook import OrderBook
+from tradestore import ColumnarTradeBook
+import asyncio
+
+
+def exchange(gateway, request, num_lines):
+    """Send request on one connection and return the first num_lines reply lines"""
+    async def run():
+        port = await gateway.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        lines = [(await reader.readline()).decode('ascii').strip() for _ in range(num_lines)]
+        writer.close()
+        await gateway.stop()
+        return lines
+    return asyncio.run(run())
+
+
+def test_replies_follow_request_order():
+    lines = exchange(OrderGateway(), b'limit sell 5 100\nlimit buy 5 100\nbogus line\nlimit buy 1 99\n', 5)
+    assert lines == ['ack 1 0', 'ack 2 1', 'match 2 1 5 100.00', 'error Bad Inputs!', 'ack 3 0']
+
+
+def test_tick_book_takes_and_reports_prices():
+    book = OrderBook(sink=NullSink(), trade_book=ColumnarTradeBook(integer_prices=True), tick_size=0.01)
+    lines = exchange(OrderGateway(book), b'limit sell 5 100.25\nlimit buy 5 100.25\n', 3)
+    assert lines == ['ack 1 0', 'ack 2 1', 'match 2 1 5 100.25']
+    assert book.trade_book[0].price == 10025
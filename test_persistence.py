@@ -0,0 +1,95 @@
+from auction import CallAuction
+from eventsink import NullSink
+from orderbook import OrderBook, Order
+from persistence import Journal, read_journal, restore
+
+QUEUE_NAMES = ('buy_queue', 'sell_queue', 'buy_stop_queue', 'sell_stop_queue')
+
+
+def journalled_book(tmp_path, **kwargs):
+    book = OrderBook(sink=NullSink())
+    journal = Journal(str(tmp_path / 'journal'), str(tmp_path / 'snapshot'), **kwargs)
+    journal.attach(book)
+    return book, journal
+
+
+def restored_book(tmp_path):
+    book = OrderBook(sink=NullSink())
+    restore(book, str(tmp_path / 'snapshot'), str(tmp_path / 'journal'))
+    return book
+
+
+def trades(book):
+    return [(t.price, t.shares, t.order_in_num, t.order_q_num) for t in book.trade_book.trade_list]
+
+
+def assert_same_book(book, other):
+    for name in QUEUE_NAMES:
+        assert sorted(getattr(book, name).entries()) == sorted(getattr(other, name).entries())
+    assert trades(book) == trades(other)
+
+
+def test_mass_cancel_is_replayed(tmp_path):
+    book, journal = journalled_book(tmp_path)
+    book.order_sorter(Order(1, ['Limit', 'BUY', 5, 99.0]))
+    book.order_sorter(Order(2, ['Stop', 'SELL', 5, 90.0]))
+    book.cancel_side('BUY')
+    book.order_sorter(Order(3, ['Market', 'SELL', 5, 0.0]))
+    journal.close()
+    assert trades(book) == []
+    assert_same_book(book, restored_book(tmp_path))
+
+
+def test_all_mass_cancel_calls_are_replayed(tmp_path):
+    book, journal = journalled_book(tmp_path)
+    for position, price in enumerate([98.0, 99.0, 100.0], 1):
+        book.order_sorter(Order(position, ['Limit', 'SELL', 5, price + 5]))
+        book.order_sorter(Order(position + 10, ['Limit', 'BUY', 5, price]))
+    book.order_sorter(Order(20, ['Stop', 'BUY', 5, 110.0]))
+    book.cancel_orders([1, 99])
+    book.cancel_price_range('BUY', 98.5, 99.5)
+    book.cancel_all_stops()
+    book.order_sorter(Order(21, ['Market', 'SELL', 10, 0.0]))
+    journal.close()
+    assert_same_book(book, restored_book(tmp_path))
+
+
+def test_auction_start_is_not_journalled_as_cancels(tmp_path):
+    book, journal = journalled_book(tmp_path)
+    book.order_sorter(Order(1, ['Limit', 'BUY', 5, 100.0]))
+    book.order_sorter(Order(2, ['Stop', 'SELL', 5, 90.0]))
+    auction = CallAuction(book)
+    auction.start()
+    book.cancel_all_stops()
+    book.order_sorter(Order(3, ['Limit', 'SELL', 5, 100.0]))
+    auction.uncross()
+    journal.close()
+    assert trades(book) == [(100.0, 5, 3, 1)]
+    kinds = [kind for kind, _record in read_journal(str(tmp_path / 'journal'))]
+    assert kinds.count('cancel') == 1
+    assert_same_book(book, restored_book(tmp_path))
+
+
+def test_orders_are_flushed_as_they_complete(tmp_path):
+    book, journal = journalled_book(tmp_path)
+    book.order_sorter(Order(1, ['Limit', 'BUY', 5, 99.0]))
+    book.order_sorter(Order(2, ['Limit', 'SELL', 5, 99.0]))
+    book.cancel_side('BUY')
+    records = [(kind, getattr(record, 'position', record)) for kind, record in read_journal(journal.path)]
+    assert records == [('order', 1), ('order', 2), ('trade', (99.0, 5, 2, 1))]
+    journal.close()
+
+
+def test_rejected_orders_are_not_journalled(tmp_path):
+    book, journal = journalled_book(tmp_path)
+    book.order_sorter(Order(1, ['Limit', 'BUY', 5, 10.0]))
+    for order in (Order(2, ['Limit', 'BYU', 5, 10.0]), Order(3, ['Frob', 'BUY', 5, 10.0])):
+        try:
+            book.order_sorter(order)
+        except ValueError:
+            pass
+    book.order_sorter(Order(4, ['Limit', 'SELL', 3, 10.0]))
+    journal.close()
+    positions = [record.position for kind, record in read_journal(journal.path) if kind == 'order']
+    assert positions == [1, 4]
+    assert_same_book(book, restored_book(tmp_path))
@@ -0,0 +1,202 @@
+from eventsink import NullSink
+from marketdata import MarketDataBook
+from multiprocessing import resource_tracker, shared_memory
+from orderbook import OrderBook
+from workload import generate_orders, scenario_config
+import argparse
+import logging
+import math
+import multiprocessing
+import os
+import struct
+import sys
+import time
+
+# Segment layout: magic, seqlock version, then the top-of-book record.  The version is odd while the record is
+# being written and counts up by two per update.  It is an aligned native word accessed through a memoryview cast, so
+# it is stored and loaded whole -- struct.pack_into zero-fills before writing and readers could catch it at 0.
+TOB_MAGIC = b'OBTOB001'
+MAGIC_FIELD = struct.Struct('<8s')
+TOB_RECORD = struct.Struct('<qdqdqd')
+VERSION_OFFSET = MAGIC_FIELD.size
+RECORD_OFFSET = VERSION_OFFSET + 8
+SEGMENT_SIZE = RECORD_OFFSET + TOB_RECORD.size
+NAN = float('nan')
+# Lets the publisher finish an update when readers and publisher share a CPU
+yield_cpu = getattr(os, 'sched_yield', lambda: time.sleep(0))
+
+
+class TopOfBookPublisher(MarketDataBook):
+    def __init__(self, name=None):
+        """Publishes the best bid and ask with their level sizes, the last trade price and the number of the last
+        order into a shared memory segment after every order_sorter call.
+
+        Writes follow a seqlock: the version is made odd, the record written and the version made even again, so
+        readers in other processes (TopOfBookReader) can poll without locks and discard torn copies.  Publishing
+        writes one fixed-size record whatever the number of readers.  name defaults to a generated one."""
+        MarketDataBook.__init__(self)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=SEGMENT_SIZE)
+        self.name = self.shm.name
+        self.version = 0
+        self.book = None
+        buf = self.shm.buf
+        self.versions = buf[VERSION_OFFSET:RECORD_OFFSET].cast('Q')
+        TOB_RECORD.pack_into(buf, RECORD_OFFSET, 0, NAN, 0, NAN, 0, NAN)
+        MAGIC_FIELD.pack_into(buf, 0, TOB_MAGIC)
+
+    def attach(self, book):
+        """Start publishing book, keeping its current sink"""
+        self.book = book
+        MarketDataBook.attach(self, book)
+        self.publish(0)
+
+    def on_order_done(self, order_in):
+        MarketDataBook.on_order_done(self, order_in)
+        self.publish(order_in.position)
+
+    def publish(self, position):
+        """Write the current top of book into the segment"""
+        bid = self.best_bid() or (NAN, 0)
+        ask = self.best_ask() or (NAN, 0)
+        last_trade = self.book.find_prev_trade()
+        last_price = NAN if last_trade is None else last_trade.price
+        versions = self.versions
+        self.version += 1
+        versions[0] = self.version
+        TOB_RECORD.pack_into(self.shm.buf, RECORD_OFFSET, position, bid[0], bid[1], ask[0], ask[1], last_price)
+        self.version += 1
+        versions[0] = self.version
+
+    def close(self):
+        """Release and remove the segment -- readers still attached keep their mapping"""
+        self.versions.release()
+        self.shm.close()
+        # Readers sharing this process's resource tracker unregistered the segment when they attached
+        resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+
+
+def attach_segment(name):
+    """Open an existing segment without registering it with this process's resource tracker, which before Python 3.13
+    would unlink the publisher's segment when a reader exits"""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if os.name == 'posix':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class TopOfBookReader:
+    def __init__(self, name):
+        """Reads the record of a TopOfBookPublisher from any local process"""
+        self.shm = attach_segment(name)
+        if self.shm.size < SEGMENT_SIZE or MAGIC_FIELD.unpack_from(self.shm.buf, 0)[0] != TOB_MAGIC:
+            self.shm.close()
+            raise ValueError('{} is not a top of book segment'.format(name))
+        self.versions = self.shm.buf[VERSION_OFFSET:RECORD_OFFSET].cast('Q')
+        self.version = 0
+        self.num_retries = 0
+
+    def read(self):
+        """Return (sequence, order number, bid, bid size, ask, ask size, last trade price) from one consistent update.
+        sequence counts the updates published so far, and missing prices are None."""
+        buf = self.shm.buf
+        versions = self.versions
+        while True:
+            version = versions[0]
+            if not version & 1:
+                record = TOB_RECORD.unpack_from(buf, RECORD_OFFSET)
+                if versions[0] == version:
+                    break
+            # The publisher was midway through an update
+            self.num_retries += 1
+            yield_cpu()
+        self.version = version
+        position, bid, bid_size, ask, ask_size, last_price = record
+        return (version >> 1, position, None if math.isnan(bid) else bid, bid_size, None if math.isnan(ask) else ask,
+                ask_size, None if math.isnan(last_price) else last_price)
+
+    def poll(self):
+        """Return read() if there has been an update since the last read, otherwise None"""
+        if self.versions[0] == self.version:
+            return None
+        return self.read()
+
+    def close(self):
+        self.versions.release()
+        self.shm.close()
+
+
+def consistent(top, previous):
+    """Whether top could have been published after previous -- a torn read would mix fields of two updates"""
+    sequence, position, bid, bid_size, ask, ask_size, _last_price = top
+    if sequence < previous[0] or position < previous[1]:
+        return False
+    if bid is not None and ask is not None and bid >= ask:
+        return False
+    # A side has a size exactly when it has a price
+    return (bid is None) == (bid_size == 0) and (ask is None) == (ask_size == 0)
+
+
+def reader_worker(name, stop, results, poll_interval):
+    """Poll every poll_interval seconds until stop is set, counting the updates seen and any inconsistent ones"""
+    reader = TopOfBookReader(name)
+    num_updates = num_bad = 0
+    previous = reader.read()
+    while not stop.is_set():
+        top = reader.poll()
+        if top is None:
+            time.sleep(poll_interval)
+            continue
+        num_updates += 1
+        if not consistent(top, previous):
+            num_bad += 1
+        previous = top
+    results.put((num_updates, num_bad, reader.num_retries))
+    reader.close()
+
+
+def run(orders, num_readers, poll_interval=0.0):
+    """Match orders with a publisher attached and num_readers polling processes, returning orders/sec and reader stats"""
+    book = OrderBook(sink=NullSink())
+    publisher = TopOfBookPublisher()
+    publisher.attach(book)
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    readers = [multiprocessing.Process(target=reader_worker, args=(publisher.name, stop, results, poll_interval))
+               for _ in range(num_readers)]
+    for process in readers:
+        process.start()
+    start = time.perf_counter()
+    for order in orders:
+        book.order_sorter(order)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    stats = [results.get() for _ in readers]
+    for process in readers:
+        process.join()
+    publisher.close()
+    return len(orders) / elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Publish top of book to shared memory with polling reader processes')
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--readers', type=int, nargs='+', default=[0, 1, 4])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--poll-interval', type=float, default=0.001,
+                        help='seconds a reader sleeps when there is no new update')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.CRITICAL)
+    for num_readers in args.readers:
+        # Matching fills the orders in place, so every run gets a fresh copy of the flow
+        orders = list(generate_orders(scenario_config('mixed', args.orders, args.seed)))
+        rate, stats = run(orders, num_readers, args.poll_interval)
+        print('{:3} readers  {:>10,.0f} orders/sec  {:>10} updates read  {} inconsistent  {} retries'.format(
+            num_readers, rate, sum(stat[0] for stat in stats), sum(stat[1] for stat in stats),
+            sum(stat[2] for stat in stats)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+from array import array
+from bisect import bisect_left
+from eventsink import NULL_SINK
+from operator import mul
+from orderbook import Trade
+import mmap
+import os
+
+
+class ColumnarTradeBook:
+    def __init__(self, chunk_size=65536, spill_dir=None, spill_threshold=1 << 20, clock=None, integer_prices=False):
+        """Drop-in replacement for TradeBook that stores trades as typed columns.
+
+        Columns grow chunk_size rows at a time.  When spill_dir is given, every spill_threshold rows held in memory are
+        appended to one file per column in spill_dir and read back through a memory map.  When clock is given (e.g.
+        time.time) every trade is also stamped with clock() so bars can be built over time windows.  integer_prices
+        stores prices as 64-bit integers, for books that trade in integer ticks."""
+        self.chunk_size = chunk_size
+        self.spill_dir = spill_dir
+        self.spill_threshold = spill_threshold
+        self.clock = clock
+        self.columns = [('seq', 'q'), ('price', 'q' if integer_prices else 'd'), ('shares', 'q'), ('order_in_num', 'q'),
+                        ('order_q_num', 'q')]
+        if clock is not None:
+            self.columns.append(('time', 'd'))
+        # In-memory chunks per column -- the last chunk of every column is the one being appended to
+        self.chunks = {name: [array(code)] for name, code in self.columns}
+        self.mmaps = {}
+        self.spilled = {}
+        self.num_spilled = 0
+        self.num_trades = 0
+        self.last_row = None
+        self.prev_trade = None
+        self.reference_trade = None
+        self.sink = NULL_SINK
+
+    def create_trade(self, trade_price, trade_vol, order_in_num, order_q_num):
+        """Appends a trade to the columns"""
+        chunks = self.chunks
+        seq = chunks['seq'][-1]
+        if len(seq) == self.chunk_size:
+            self.new_chunk()
+            seq = chunks['seq'][-1]
+        seq.append(self.num_trades)
+        chunks['price'][-1].append(trade_price)
+        chunks['shares'][-1].append(trade_vol)
+        chunks['order_in_num'][-1].append(order_in_num)
+        chunks['order_q_num'][-1].append(order_q_num)
+        if self.clock is not None:
+            chunks['time'][-1].append(self.clock())
+        self.num_trades += 1
+        self.last_row = (trade_price, trade_vol, order_in_num, order_q_num)
+        self.prev_trade = None
+        self.sink.on_trade(trade_price, trade_vol, order_in_num, order_q_num)
+
+    def last_trade(self):
+        """Return the most recent trade in O(1) -- the Trade object is built once per trade"""
+        if self.prev_trade is None:
+            if self.last_row is None:
+                return self.reference_trade
+            self.prev_trade = Trade(*self.last_row)
+        return self.prev_trade
+
+    def __len__(self):
+        return self.num_trades
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.num_trades
+        if not 0 <= i < self.num_trades:
+            raise IndexError('trade index out of range')
+        return Trade(*[next(self.segments(name, i, i + 1))[0]
+                       for name in ('price', 'shares', 'order_in_num', 'order_q_num')])
+
+    def new_chunk(self):
+        """Start a new chunk for every column, spilling the in-memory chunks once spill_threshold is reached"""
+        in_memory = self.num_trades - self.num_spilled
+        if self.spill_dir is not None and in_memory >= self.spill_threshold:
+            self.spill()
+        else:
+            for name, code in self.columns:
+                self.chunks[name].append(array(code))
+
+    def spill(self):
+        """Append every in-memory row to the column files and memory map them.
+        The first spill truncates the column files, so files left in spill_dir by an earlier store are not read back."""
+        os.makedirs(self.spill_dir, exist_ok=True)
+        mode = 'ab' if self.num_spilled else 'wb'
+        for name, code in self.columns:
+            path = os.path.join(self.spill_dir, name + '.col')
+            with open(path, mode) as f:
+                for chunk in self.chunks[name]:
+                    chunk.tofile(f)
+            self.chunks[name] = [array(code)]
+            if name in self.spilled:
+                self.spilled[name].release()
+                self.mmaps[name].close()
+            with open(path, 'rb') as f:
+                self.mmaps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.spilled[name] = memoryview(self.mmaps[name]).cast(code)
+        self.num_spilled = self.num_trades
+
+    def close(self):
+        """Release the memory maps of spilled columns"""
+        for name in list(self.spilled):
+            self.spilled.pop(name).release()
+            self.mmaps.pop(name).close()
+
+    def segments(self, name, start=0, stop=None):
+        """Yield the spilled view and in-memory chunks of a column restricted to rows [start, stop)"""
+        if stop is None or stop > self.num_trades:
+            stop = self.num_trades
+        offset = 0
+        pieces = [self.spilled[name]] if name in self.spilled else []
+        pieces.extend(self.chunks[name])
+        for piece in pieces:
+            end = offset + len(piece)
+            if end > start and offset < stop:
+                yield piece[max(start - offset, 0):min(stop, end) - offset]
+            offset = end
+            if offset >= stop:
+                return
+
+    def column(self, name, start=0, stop=None):
+        """Return rows [start, stop) of a column as a single typed array"""
+        code = dict(self.columns)[name]
+        out = array(code)
+        for segment in self.segments(name, start, stop):
+            if isinstance(segment, array):
+                out.extend(segment)
+            else:
+                out.frombytes(segment.cast('B'))
+        return out
+
+    def vwap(self, start=0, stop=None):
+        """Volume weighted average price of trades [start, stop)"""
+        notional = 0.0
+        volume = 0
+        for prices, shares in zip(self.segments('price', start, stop), self.segments('shares', start, stop)):
+            notional += sum(map(mul, prices, shares))
+            volume += sum(shares)
+        if volume == 0:
+            return None
+        return notional / volume
+
+    def ohlc(self, window, by='seq', start=0, stop=None):
+        """Return (start, open, high, low, close, volume) bars of window trades, or of window seconds when by='time'"""
+        if stop is None or stop > self.num_trades:
+            stop = self.num_trades
+        if start >= stop:
+            return []
+        if by == 'seq':
+            bounds = [(row, row, min(row + window, stop)) for row in range(start, stop, window)]
+        elif by == 'time':
+            if self.clock is None:
+                raise ValueError('Trades are only timestamped when the book is given a clock!')
+            times = self.column('time', start, stop)
+            bounds = []
+            row = 0
+            while row < len(times):
+                bar_start = times[row] - times[row] % window
+                end = bisect_left(times, bar_start + window, row)
+                bounds.append((bar_start, start + row, start + end))
+                row = end
+        else:
+            raise ValueError('Bad Inputs!')
+        bars = []
+        for key, first, last in bounds:
+            prices = self.column('price', first, last)
+            bars.append((key, prices[0], max(prices), min(prices), prices[-1], sum(self.column('shares', first, last))))
+        return bars
+
+    def volume_by_order(self):
+        """Return the total shares traded by every order id, counting both the incoming and resting side"""
+        volumes = {}
+        for name in ('order_in_num', 'order_q_num'):
+            for ids, shares in zip(self.segments(name), self.segments('shares')):
+                for order_id, volume in zip(ids, shares):
+                    volumes[order_id] = volumes.get(order_id, 0) + volume
+        return volumes
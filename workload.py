@@ -0,0 +1,118 @@
+from orderbook import Order
+import random
+
+
+class WorkloadConfig:
+    def __init__(self, num_orders=100000, limit_ratio=0.6, market_ratio=0.15, stop_ratio=0.05, cancel_ratio=0.2,
+                 mid_price=100.0, tick_size=0.01, volatility=0.5, depth=50, stop_offset=20, max_volume=100,
+                 market_max_volume=None, prefill=0, seed=0, amend_ratio=0.0, in_ticks=False):
+        """Parameters of a synthetic order flow.
+
+        The ratios weight how often each order type is drawn -- half of the amends lower the volume in place and the
+        rest move the order a couple of ticks.  The mid price takes a random walk with a standard deviation of
+        volatility ticks per order.  Limit prices land up to depth ticks behind the mid and stops up to stop_offset
+        ticks away from it.  prefill passive limit orders are placed before the mixed flow starts.  in_ticks gives
+        prices as integer ticks of tick_size, for an OrderBook made with that tick_size."""
+        self.num_orders = num_orders
+        self.limit_ratio = limit_ratio
+        self.market_ratio = market_ratio
+        self.stop_ratio = stop_ratio
+        self.cancel_ratio = cancel_ratio
+        self.amend_ratio = amend_ratio
+        self.mid_price = mid_price
+        self.tick_size = tick_size
+        self.volatility = volatility
+        self.depth = depth
+        self.stop_offset = stop_offset
+        self.max_volume = max_volume
+        self.market_max_volume = market_max_volume or max_volume
+        self.prefill = prefill
+        self.seed = seed
+        self.in_ticks = in_ticks
+
+
+def generate_orders(config):
+    """Yield the prefill and then num_orders mixed orders, numbered from 1 -- the same seed gives the same flow"""
+    rng = random.Random(config.seed)
+    tick = config.tick_size
+    if config.in_ticks:
+        price_of = int
+    else:
+        def price_of(ticks):
+            return round(ticks * tick, 8)
+    mid_ticks = round(config.mid_price / tick)
+    # Ids of orders that may still be resting and can be cancelled or amended, with their price in ticks and volume
+    live_ids = []
+    live_orders = {}
+    weights = [config.limit_ratio, config.market_ratio, config.stop_ratio, config.cancel_ratio, config.amend_ratio]
+    kinds = rng.choices(['Limit', 'Market', 'Stop', 'Cancel', 'Amend'], weights, k=config.num_orders)
+    position = 0
+    for _ in range(config.prefill):
+        position += 1
+        side = rng.choice(['BUY', 'SELL'])
+        offset = rng.randint(1, config.depth)
+        ticks = mid_ticks - offset if side == 'BUY' else mid_ticks + offset
+        volume = rng.randint(1, config.max_volume)
+        live_ids.append(position)
+        live_orders[position] = (ticks, volume)
+        yield Order(position, ['Limit', side, volume, price_of(ticks)])
+    for kind in kinds:
+        position += 1
+        mid_ticks += round(rng.gauss(0, config.volatility))
+        side = rng.choice(['BUY', 'SELL'])
+        if kind == 'Cancel' and live_ids:
+            # Swap a random live id to the end so it can be popped in O(1)
+            i = rng.randrange(len(live_ids))
+            live_ids[i], live_ids[-1] = live_ids[-1], live_ids[i]
+            order_id = live_ids.pop()
+            del live_orders[order_id]
+            yield Order(position, ['Cancel', 'na', order_id, price_of(0)])
+        elif kind == 'Amend' and live_ids:
+            i = rng.randrange(len(live_ids))
+            order_id = live_ids[i]
+            ticks, volume = live_orders.pop(order_id)
+            if volume > 1 and rng.random() < 0.5:
+                volume = rng.randint(1, volume - 1)
+                live_orders[order_id] = (ticks, volume)
+            else:
+                # The amended order is replaced by one numbered after the amend -- the price always moves, since an
+                # amend to the same price and volume leaves the order in place under its old number
+                ticks += rng.choice((-2, -1, 1, 2))
+                live_ids[i] = position
+                live_orders[position] = (ticks, volume)
+            yield Order(position, ['Amend', 'na', order_id, volume, price_of(ticks)])
+        elif kind == 'Market':
+            yield Order(position, ['Market', side, rng.randint(1, config.market_max_volume), price_of(0)])
+        elif kind == 'Stop':
+            offset = rng.randint(1, config.stop_offset)
+            ticks = mid_ticks + offset if side == 'BUY' else mid_ticks - offset
+            volume = rng.randint(1, config.max_volume)
+            live_ids.append(position)
+            live_orders[position] = (ticks, volume)
+            yield Order(position, ['Stop', side, volume, price_of(ticks)])
+        else:
+            # A few limit orders land through the mid and trade on arrival
+            offset = rng.randint(-3, config.depth)
+            ticks = mid_ticks - offset if side == 'BUY' else mid_ticks + offset
+            volume = rng.randint(1, config.max_volume)
+            live_ids.append(position)
+            live_orders[position] = (ticks, volume)
+            yield Order(position, ['Limit', side, volume, price_of(ticks)])
+
+
+SCENARIOS = {
+    'mixed': dict(),
+    'deep_book': dict(prefill=200000, depth=2000, market_ratio=0.1, cancel_ratio=0.1),
+    'cancel_storm': dict(limit_ratio=0.3, market_ratio=0.05, stop_ratio=0.0, cancel_ratio=0.65, prefill=20000),
+    'stop_cascade': dict(limit_ratio=0.5, market_ratio=0.2, stop_ratio=0.3, cancel_ratio=0.0, stop_offset=5,
+                         volatility=1.0),
+    'quote_update': dict(limit_ratio=0.2, market_ratio=0.05, stop_ratio=0.0, cancel_ratio=0.05, amend_ratio=0.7,
+                         prefill=20000),
+    'market_sweep': dict(prefill=50000, depth=500, limit_ratio=0.55, market_ratio=0.4, stop_ratio=0.0,
+                         cancel_ratio=0.05, market_max_volume=5000),
+}
+
+
+def scenario_config(name, num_orders=100000, seed=0):
+    """WorkloadConfig for one of the named SCENARIOS"""
+    return WorkloadConfig(num_orders=num_orders, seed=seed, **SCENARIOS[name])